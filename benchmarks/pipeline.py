@@ -0,0 +1,257 @@
+"""Benchmark de las etapas de CPU del pipeline de imágenes
+
+Uso:
+    python -m benchmarks.pipeline [--megapixeles 0.3,2,8,12,24] [--formatos jpeg,png,webp]
+                                  [--repeticiones 3] [--salida resultados.json]
+                                  [--comparar anterior.json] [--umbral 15]
+
+Genera imágenes sintéticas (degradado + ruido, para que comprimen como una foto)
+en cada formato y tamaño, y mide por etapa el tiempo (mínimo, mediana y media en
+ms) y el pico de memoria: RSS del proceso sobre la línea base y pico del heap de
+Python. El resultado es un JSON estable; con --comparar se listan las etapas cuya
+mediana empeora más de --umbral % y se sale con código 1 si hay regresiones.
+"""
+
+import argparse
+import ctypes
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import PIL
+from PIL import Image
+
+from utils.exportar import construir_zip
+from utils.imagen import agregar_exif, con_descripcion, imagen_a_bytes, limpiar_nombre, preparar_para_envio
+from utils.resultados import crear_miniatura
+
+MEGAPIXELES = (0.3, 2, 8, 12, 24)
+FORMATOS = ("jpeg", "png", "webp")
+TEXTO_ALT = "Montañas nevadas bajo un cielo despejado con un lago en primer plano y árboles a la orilla."
+NOMBRES = [f"Foto {n}: Paisaje de montaña con lago, árboles y cielo despejado ({n % 7})" for n in range(2000)]
+
+
+def imagen_sintetica(megapixeles):
+    """RGB 3:2 con degradados y ruido: ni trivial de comprimir ni puro ruido"""
+    alto = max(1, round((megapixeles * 1e6 / 1.5) ** 0.5))
+    ancho = round(alto * 1.5)
+    horizontal = Image.linear_gradient('L').resize((ancho, alto))
+    radial = Image.radial_gradient('L').resize((ancho, alto))
+    ruido = Image.effect_noise((ancho, alto), 24)
+    return Image.merge('RGB', (horizontal, ruido, radial))
+
+
+def codificar(imagen, formato):
+    buffer = io.BytesIO()
+    opciones = {"quality": 90} if formato in ("jpeg", "webp") else {}
+    imagen.save(buffer, format=formato.upper(), **opciones)
+    return buffer.getvalue()
+
+
+def _liberar_memoria():
+    """Devuelve al sistema la memoria libre para que el pico de RSS sea de la etapa medida"""
+    gc.collect()
+    Image.core.clear_cache()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def _rss():
+    """RSS actual en bytes (Linux); None donde no hay /proc"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class MuestreoRSS:
+    """Hilo que muestrea el RSS cada `intervalo` s y guarda el máximo"""
+
+    def __init__(self, intervalo=0.002):
+        self.intervalo = intervalo
+        self.base = _rss()
+        self.pico = self.base
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+
+    def _bucle(self):
+        while not self._parar.wait(self.intervalo):
+            self.pico = max(self.pico, _rss())
+
+    def __enter__(self):
+        if self.base is not None:
+            self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.base is not None:
+            self._parar.set()
+            self._hilo.join()
+            self.pico = max(self.pico, _rss())
+
+    @property
+    def incremento(self):
+        return None if self.base is None else self.pico - self.base
+
+
+def medir(funcion, repeticiones):
+    """Tiempos de `repeticiones` llamadas y una pasada extra para la memoria"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+
+    _liberar_memoria()
+    tracemalloc.start()
+    with MuestreoRSS() as rss:
+        funcion()
+    _, pico_python = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "tiempos_ms": {
+            "min": round(min(tiempos), 3),
+            "mediana": round(statistics.median(tiempos), 3),
+            "media": round(statistics.fmean(tiempos), 3),
+        },
+        "memoria_pico_mb": None if rss.incremento is None else round(rss.incremento / 2**20, 2),
+        "python_pico_mb": round(pico_python / 2**20, 2),
+    }
+
+
+def decodificar(datos):
+    imagen = Image.open(io.BytesIO(datos))
+    return imagen.convert('RGB') if imagen.mode != 'RGB' else imagen.copy()
+
+
+def etapas_imagen(datos):
+    """Etapas por imagen, en el orden en que las recorre la app"""
+    imagen = decodificar(datos)
+    exif = agregar_exif(None, TEXTO_ALT)
+    return {
+        "decodificar": lambda: decodificar(datos),
+        "miniatura": lambda: crear_miniatura(imagen),
+        # Miniatura al ingerir, desde los bytes: en JPEG decodifica con draft() a escala reducida
+        "miniatura_ingesta": lambda: crear_miniatura(datos),
+        "preparar_envio": lambda: preparar_para_envio(datos),
+        "exif": lambda: agregar_exif(None, TEXTO_ALT),
+        # Camino real de descarga: metadatos nativos en el mismo formato, sin recodificar
+        "codificar_descarga": lambda: con_descripcion(datos, TEXTO_ALT),
+        # Recodificación JPEG q95 forzada, como hacía la app con todos los formatos
+        "codificar_q95": lambda: imagen_a_bytes(imagen, exif).getvalue(),
+    }
+
+
+def entorno():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def ejecutar(megapixeles, formatos, repeticiones, progreso=None):
+    resultados = []
+
+    def anotar(etapa, formato, mp, medida, **extra):
+        resultados.append({"etapa": etapa, "formato": formato, "megapixeles": mp, **extra, **medida})
+        if progreso:
+            progreso(resultados[-1])
+
+    for formato in formatos:
+        salidas = []
+        for mp in megapixeles:
+            imagen = imagen_sintetica(mp)
+            datos = codificar(imagen, formato)
+            extra = {"ancho": imagen.width, "alto": imagen.height, "bytes": len(datos)}
+            del imagen
+            for etapa, funcion in etapas_imagen(datos).items():
+                anotar(etapa, formato, mp, medir(funcion, repeticiones), **extra)
+            salidas.append((f"{formato}_{mp}.{formato}", con_descripcion(datos, TEXTO_ALT)))
+        # El ZIP se mide con todas las descargas de un formato, como una exportación real
+        anotar("zip", formato, sum(megapixeles), medir(lambda: construir_zip(salidas).close(), repeticiones),
+               bytes=sum(len(d) for _, d in salidas))
+
+    anotar("limpiar_nombre", None, 0, medir(lambda: [limpiar_nombre(n) for n in NOMBRES], repeticiones),
+           nombres=len(NOMBRES))
+    return resultados
+
+
+def _clave(fila):
+    return (fila["etapa"], fila["formato"], fila["megapixeles"])
+
+
+def comparar(actual, anterior, umbral):
+    """Filas cuya mediana empeora más de `umbral` % respecto a `anterior`"""
+    previas = {_clave(f): f for f in anterior["resultados"]}
+    regresiones = []
+    for fila in actual["resultados"]:
+        previa = previas.get(_clave(fila))
+        if previa is None:
+            continue
+        antes, ahora = previa["tiempos_ms"]["mediana"], fila["tiempos_ms"]["mediana"]
+        if antes > 0 and (ahora - antes) / antes * 100 > umbral:
+            regresiones.append((fila, antes, ahora))
+    return regresiones
+
+
+def _lista(tipo):
+    return lambda texto: [tipo(x) for x in texto.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.pipeline",
+                                     description="Mide las etapas de CPU del pipeline de imágenes.")
+    parser.add_argument("--megapixeles", type=_lista(float), default=list(MEGAPIXELES))
+    parser.add_argument("--formatos", type=_lista(str.lower), default=list(FORMATOS))
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--salida", help="archivo JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--umbral", type=float, default=15.0, help="% de empeoramiento tolerado")
+    args = parser.parse_args(argv)
+
+    def progreso(fila):
+        print(f"{fila['etapa']:>18} {fila['formato'] or '-':>5} {fila['megapixeles']:>6} MP "
+              f"{fila['tiempos_ms']['mediana']:>10.2f} ms  {fila['memoria_pico_mb']} MB", file=sys.stderr)
+
+    informe = {"entorno": entorno(), "repeticiones": args.repeticiones,
+               "resultados": ejecutar(args.megapixeles, args.formatos, max(1, args.repeticiones), progreso)}
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(informe, json.load(f), args.umbral)
+        for fila, antes, ahora in regresiones:
+            print(f"REGRESIÓN {fila['etapa']} {fila['formato']} {fila['megapixeles']} MP: "
+                  f"{antes:.2f} → {ahora:.2f} ms", file=sys.stderr)
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
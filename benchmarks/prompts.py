@@ -0,0 +1,128 @@
+"""Informe del tamaño de los prompts de PROMPTS_CATEGORIAS
+
+Uso:
+    python -m benchmarks.prompts [--exacto] [--por-solicitud 4]
+                                 [--salida prompts.json] [--comparar anterior.json]
+
+El prompt viaja con cada imagen, así que sus tokens se pagan una vez por imagen
+(o una vez por paquete con GEMINI_POR_SOLICITUD). Por categoría e idioma se
+listan caracteres, palabras y tokens del prompt completo y de su bloque de
+reglas, su peso frente a los TOKENS_IMAGEN de la imagen y lo que cuesta por
+imagen dentro de un paquete. Los tokens se estiman (~4 caracteres por token);
+con --exacto se cuentan con count_tokens del modelo (necesita GEMINI_API_KEY).
+Con --comparar se muestra la diferencia de tokens con un informe anterior, para
+medir el efecto de recortar las reglas.
+"""
+
+import argparse
+import json
+import re
+import sys
+
+from utils.backends import TOKENS_IMAGEN, estimar_tokens
+from utils.gemini import (
+    GEMINI_POR_SOLICITUD, GEMINI_PRECIO_ENTRADA, MODELO_GEMINI, PROMPTS_CATEGORIAS, construir_prompt_paquete
+)
+
+# Inicio del bloque de reglas en los prompts en español e inglés
+_REGLAS = re.compile(r'^(Reglas|Rules):', re.MULTILINE)
+
+
+def separar_reglas(prompt):
+    """(formato, reglas): el bloque de reglas empieza en la línea "Reglas:" o "Rules:" """
+    marca = _REGLAS.search(prompt)
+    if marca is None:
+        return prompt, ""
+    return prompt[:marca.start()].rstrip(), prompt[marca.start():]
+
+
+def contador_exacto():
+    """count_tokens del modelo configurado; solo con el backend real"""
+    from utils.gemini import BACKEND_DISPONIBLE, GEMINI_BACKEND, obtener_modelo_gemini
+    if GEMINI_BACKEND != "gemini" or not BACKEND_DISPONIBLE:
+        raise SystemExit("--exacto necesita GEMINI_BACKEND=gemini y GEMINI_API_KEY")
+    modelo = obtener_modelo_gemini()
+    return lambda texto: modelo.count_tokens(texto).total_tokens if texto else 0
+
+
+def medir(contar, por_solicitud):
+    """{"categoria/idioma": medidas} para todos los prompts"""
+    informe = {}
+    for categoria, idiomas in PROMPTS_CATEGORIAS.items():
+        for idioma, prompt in idiomas.items():
+            _, reglas = separar_reglas(prompt)
+            tokens = contar(prompt)
+            tokens_reglas = contar(reglas)
+            medidas = {
+                "caracteres": len(prompt),
+                "palabras": len(prompt.split()),
+                "tokens": tokens,
+                "tokens_reglas": tokens_reglas,
+                "lineas_reglas": sum(linea.startswith("- ") for linea in reglas.splitlines()),
+                # Parte de la entrada de cada imagen que es texto del prompt
+                "peso_en_entrada": round(tokens / (tokens + TOKENS_IMAGEN), 3),
+                "coste_por_1000_imagenes": round(tokens * 1000 * GEMINI_PRECIO_ENTRADA / 1e6, 4),
+            }
+            if por_solicitud > 1:
+                paquete = contar(construir_prompt_paquete(por_solicitud, idioma, categoria))
+                medidas["tokens_por_imagen_en_paquete"] = round(paquete / por_solicitud, 1)
+            informe[f"{categoria}/{idioma}"] = medidas
+    return informe
+
+
+def imprimir(informe, por_solicitud, anterior=None):
+    columnas = ["prompt", "caract.", "palabras", "tokens", "reglas", "% reglas", "% entrada", "USD/1000 img"]
+    if por_solicitud > 1:
+        columnas.append(f"tokens/img ({por_solicitud} por solicitud)")
+    if anterior:
+        columnas.append("Δ tokens")
+    print(" | ".join(columnas))
+    for nombre, m in informe.items():
+        fila = [
+            nombre, str(m["caracteres"]), str(m["palabras"]), str(m["tokens"]),
+            f"{m['tokens_reglas']} ({m['lineas_reglas']} líneas)",
+            f"{100 * m['tokens_reglas'] / m['tokens']:.0f} %" if m["tokens"] else "-",
+            f"{100 * m['peso_en_entrada']:.0f} %",
+            f"{m['coste_por_1000_imagenes']:.4f}",
+        ]
+        if por_solicitud > 1:
+            fila.append(str(m["tokens_por_imagen_en_paquete"]))
+        if anterior:
+            previo = anterior.get(nombre)
+            fila.append(f"{m['tokens'] - previo['tokens']:+d}" if previo else "nuevo")
+        print(" | ".join(fila))
+    total = sum(m["tokens"] for m in informe.values())
+    reglas = sum(m["tokens_reglas"] for m in informe.values())
+    print(f"\nReglas: {reglas} de {total} tokens de prompt ({100 * reglas / total:.0f} %); "
+          f"cada imagen suma además {TOKENS_IMAGEN} tokens de imagen.")
+
+
+def _leer_informe(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)["prompts"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.prompts",
+                                     description="Mide cuántos tokens cuesta cada prompt por imagen.")
+    parser.add_argument("--exacto", action="store_true", help="contar con count_tokens del modelo")
+    parser.add_argument("--por-solicitud", type=int, default=GEMINI_POR_SOLICITUD,
+                        help="imágenes por paquete para el coste por imagen (por defecto GEMINI_POR_SOLICITUD)")
+    parser.add_argument("--salida", help="archivo JSON donde guardar el informe")
+    parser.add_argument("--comparar", help="informe JSON anterior con el que comparar los tokens")
+    args = parser.parse_args(argv)
+
+    contar = contador_exacto() if args.exacto else estimar_tokens
+    por_solicitud = max(1, args.por_solicitud)
+    informe = medir(contar, por_solicitud)
+    imprimir(informe, por_solicitud, _leer_informe(args.comparar) if args.comparar else None)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"modelo": MODELO_GEMINI, "metodo": "exacto" if args.exacto else "estimado",
+                       "tokens_imagen": TOKENS_IMAGEN, "prompts": informe}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,17 +3,83 @@ GaryText Pro - Interfaz Accesible WCAG 2.2 AA
 Optimizado para NVDA y JAWS
 """
 
+import time
+INICIO_SCRIPT = time.perf_counter()
+
+import bisect
+import io
+import logging
+import os
+import re
+import sys
+import tempfile
 import streamlit as st
 import streamlit.components.v1 as components
 from PIL import Image
-import io
-import zipfile
-import time
 
-from utils.gemini import GEMINI_API_KEY, describir_imagen
-from utils.imagen import limpiar_nombre, agregar_exif, imagen_a_bytes
-from utils.contadores import obtener_contadores, actualizar_contadores, JSONBIN_BIN_ID, JSONBIN_API_KEY
+# En frío: primera ejecución del proceso, con los módulos de la app aún sin importar
+EN_FRIO = "utils.gemini" not in sys.modules
+
+from utils.gemini import (
+    BACKEND_DISPONIBLE, GEMINI_HILOS, GEMINI_POR_SOLICITUD, costo_tokens, precalentar, sumar_tokens
+)
+from utils.imagen import EXTENSION_FORMATO, MIME_FORMATO, con_descripcion, limpiar_nombre
+from utils.resultados import Resultado, aplicar_presupuesto, crear_miniatura
+from utils.cache import huella_contenido
+from utils.config import secreto
+from utils.diario import DiarioLotes, id_trabajo
+from utils.exportar import construir_zip
+from utils.ingesta import INGESTA_MAX_MB, ImagenRechazada, revisar
+from utils.contadores import contadores_en_cache, actualizar_contadores
 from utils.estilos import CSS_WCAG
+from utils.metricas import ETAPAS, metricas, servir_http
+from utils.similitud import IndiceSimilitud
+from utils.trabajador import TrabajadorLote
+
+IMPORTACIONES = time.perf_counter() - INICIO_SCRIPT
+
+# Bits de diferencia tolerados para considerar dos fotos casi idénticas (de 64)
+SIMILITUD_UMBRAL = int(secreto("SIMILITUD_UMBRAL", 5))
+
+# Opción del selector de idioma → códigos de idioma pedidos
+IDIOMAS_OPCION = {"Español": ["es"], "Inglés": ["en"], "Español e Inglés": ["es", "en"]}
+IDIOMAS_NOMBRE = {"es": "Español", "en": "Inglés"}
+
+# Bytes originales que cada sesión mantiene en memoria; el resto se vuelca a disco
+SESION_MEMORIA_MAX = int(secreto("SESION_MEMORIA_MAX_MB", 64)) * 1024 * 1024
+SESION_DIRECTORIO = os.path.join(tempfile.gettempdir(), "garytext_sesiones")
+
+# Diario de lotes para reanudar tras recargas, reinicios o errores
+DIARIO_RUTA = secreto("DIARIO_RUTA", os.path.join(tempfile.gettempdir(), "garytext_diario.sqlite3"))
+
+# Segundos entre consultas del progreso mientras el lote se procesa en segundo plano
+PROGRESO_INTERVALO = float(secreto("PROGRESO_INTERVALO", 1.0))
+
+# Puerto opcional para exponer /metrics (Prometheus) y /metrics.json
+METRICAS_PUERTO = secreto("METRICAS_PUERTO", "")
+
+log = logging.getLogger("garytext")
+
+
+@st.cache_resource
+def obtener_diario():
+    """Diario compartido por todas las sesiones (y que sobrevive a ellas)"""
+    return DiarioLotes(DIARIO_RUTA)
+
+
+@st.cache_resource
+def iniciar_servidor_metricas(puerto):
+    """Un único servidor de métricas por proceso"""
+    try:
+        return servir_http(puerto)
+    except OSError as e:
+        log.warning(f"No se pudo abrir el puerto de métricas {puerto}: {e}")
+        return None
+
+
+if METRICAS_PUERTO:
+    iniciar_servidor_metricas(int(METRICAS_PUERTO))
+
 
 st.set_page_config(
     page_title="GaryText Pro",
@@ -48,6 +114,9 @@ if 'resultados' not in st.session_state:
     st.session_state.resultados = []
 if 'archivos_previos' not in st.session_state:
     st.session_state.archivos_previos = set()
+if 'rechazos' not in st.session_state:
+    # file_id → (nombre, motivo) de los archivos que no pasan la revisión de ingesta
+    st.session_state.rechazos = {}
 if 'uploader_key' not in st.session_state:
     st.session_state.uploader_key = 0
 if 'mensaje_alerta' not in st.session_state:
@@ -62,6 +131,25 @@ if 'foco_resultados' not in st.session_state:
     st.session_state.foco_resultados = False
 if 'foco_subir' not in st.session_state:
     st.session_state.foco_subir = False
+if 'trabajo' not in st.session_state:
+    # Lote actual: id en el diario, huellas por posición y variantes (idioma, categoría)
+    st.session_state.trabajo = None
+if 'pendientes' not in st.session_state:
+    st.session_state.pendientes = []
+if 'cache_descargas' not in st.session_state:
+    # (id imagen, descripción, guardar_exif) -> bytes listos para descargar
+    st.session_state.cache_descargas = {}
+if 'zip_preparado' not in st.session_state:
+    # (firma de los resultados, archivo temporal con el ZIP) o None
+    st.session_state.zip_preparado = None
+if 'indices_similitud' not in st.session_state:
+    # Un índice por conjunto de variantes; se conserva entre lotes de la sesión
+    st.session_state.indices_similitud = {}
+if 'trabajador' not in st.session_state:
+    # TrabajadorLote que procesa el lote actual en segundo plano, o None
+    st.session_state.trabajador = None
+if 'anuncio_progreso' not in st.session_state:
+    st.session_state.anuncio_progreso = ""
 
 # Funciones de callback
 def marcar_descarga(nombre_archivo):
@@ -72,9 +160,30 @@ def marcar_descarga_zip():
     st.session_state.mensaje_alerta = "Descarga completada: todas las imágenes en archivo ZIP."
     st.session_state.mostrar_visual = True
 
-def limpiar_todo():
+def escapar_markdown(texto):
+    """Los nombres de archivo se muestran literales aunque lleven _, * o corchetes"""
+    return re.sub(r'([\\`*_\[\]<>#|])', r'\\\1', texto)
+
+def vaciar_resultados():
+    for r in st.session_state.resultados:
+        r.liberar()
     st.session_state.resultados = []
+
+def detener_trabajador():
+    if st.session_state.trabajador is not None:
+        st.session_state.trabajador.cancelar()
+        st.session_state.trabajador = None
+    st.session_state.anuncio_progreso = ""
+
+def limpiar_todo():
+    detener_trabajador()
+    descartar_zip()
+    st.session_state.cache_descargas = {}
+    vaciar_resultados()
+    st.session_state.trabajo = None
+    st.session_state.pendientes = []
     st.session_state.archivos_previos = set()
+    st.session_state.rechazos = {}
     st.session_state.uploader_key += 1
     st.session_state.error_procesamiento = False
     st.session_state.procesando_indice = -1
@@ -83,18 +192,110 @@ def limpiar_todo():
     st.session_state.foco_subir = True
 
 def quitar_resultado(indice):
-    st.session_state.resultados.pop(indice)
+    st.session_state.resultados.pop(indice).liberar()
     if not st.session_state.resultados:
         st.session_state.archivos_previos = set()
         st.session_state.uploader_key += 1
         st.session_state.mensaje_alerta = "Resultados eliminados. Puedes subir nuevas imágenes."
         st.session_state.mostrar_visual = True
 
+def texto_tokens(uso):
+    """Resumen legible de un dict de tokens: entrada (de ella, imagen) y salida"""
+    texto = f"{uso.get('entrada', 0):,} tokens de entrada"
+    if uso.get("imagen"):
+        texto += f" ({uso['imagen']:,} de imagen y {uso.get('texto', 0):,} de texto)"
+    return texto + f" y {uso.get('salida', 0):,} de salida"
+
+def datos_descarga(r, guardar_exif, cache):
+    """Bytes de descarga: los que dejó listos el pipeline o, si no, el original con la descripción actual"""
+    datos = cache.get((r.id, r.descripcion, guardar_exif))
+    if datos is None:
+        datos = con_descripcion(r.original, r.descripcion if guardar_exif else None)
+    return datos
+
+def lector_descarga(r, guardar_exif):
+    """Como lector_zip: los bytes de un resultado se generan al pulsar su botón, no en cada ejecución"""
+    cache = st.session_state.cache_descargas
+    return lambda: datos_descarga(r, guardar_exif, cache)
+
+def agregar_resultados(posicion, original, respuestas, miniatura=None, formato=None):
+    """Inserta un Resultado por variante en su posición de subida (los lotes reanudados llegan desordenados)"""
+    if miniatura is None:
+        formato = Image.open(io.BytesIO(original)).format
+        miniatura = crear_miniatura(original)
+    resultados = st.session_state.resultados
+    for variante, resultado in zip(st.session_state.trabajo["variantes"], respuestas):
+        # Se guardan los bytes subidos y una miniatura, no los píxeles decodificados
+        nuevo = Resultado(
+            id=st.session_state.trabajo["huellas"][posicion],
+            nombre=f"{limpiar_nombre(resultado['nombre'])}.{EXTENSION_FORMATO.get(formato, 'jpg')}",
+            descripcion=resultado['descripcion'],
+            original=original,
+            formato=formato,
+            miniatura=miniatura,
+            posicion=posicion,
+            variante=tuple(variante),
+            tokens=resultado.get('tokens')
+        )
+        resultados.insert(bisect.bisect([r.posicion for r in resultados], posicion), nuevo)
+
+def posiciones_fallidas():
+    """Posiciones del lote actual sin resultado correcto en el diario"""
+    trabajo = st.session_state.trabajo
+    if trabajo is None:
+        return []
+    completadas = obtener_diario().completadas(trabajo["id"])
+    return [p for p, h in enumerate(trabajo["huellas"]) if h not in completadas]
+
+def reanudar_trabajo():
+    """Reintenta solo las imágenes sin resultado correcto, conservando las demás"""
+    pendientes = posiciones_fallidas()
+    quitar = set(pendientes)
+    for r in [r for r in st.session_state.resultados if r.posicion in quitar]:
+        st.session_state.resultados.remove(r)
+        r.liberar()
+    detener_trabajador()
+    descartar_zip()
+    st.session_state.pendientes = pendientes
+    st.session_state.error_procesamiento = False
+    st.session_state.procesando_indice = len(st.session_state.trabajo["huellas"]) - len(pendientes)
+    total = len(pendientes)
+    st.session_state.mensaje_alerta = f"Reintentando {total} {'imagen' if total == 1 else 'imágenes'}, espera un momento."
+    st.session_state.mostrar_visual = True
+
+def firma_zip(guardar_exif):
+    """Identifica el contenido del ZIP: cambia si se edita, quita o renombra algo"""
+    return (guardar_exif, tuple((r.nombre, r.descripcion) for r in st.session_state.resultados))
+
+def descartar_zip():
+    if st.session_state.zip_preparado is not None:
+        st.session_state.zip_preparado[1].close()
+        st.session_state.zip_preparado = None
+
+def lector_zip(archivo_zip):
+    """Lee el ZIP preparado solo al pulsar Descargar (en un hilo aparte), no en cada ejecución"""
+    def leer():
+        archivo_zip.seek(0)
+        return archivo_zip.read()
+    return leer
+
+def preparar_zip(guardar_exif):
+    """Construye el ZIP solo cuando el usuario lo pide, una imagen a la vez"""
+    def elementos():
+        for r in st.session_state.resultados:
+            yield r.nombre, datos_descarga(r, guardar_exif, st.session_state.cache_descargas)
+
+    descartar_zip()
+    with metricas.cronometro("zip"):
+        st.session_state.zip_preparado = (firma_zip(guardar_exif), construir_zip(elementos()))
+    st.session_state.mensaje_alerta = "Archivo ZIP preparado. Ya puedes descargarlo."
+    st.session_state.mostrar_visual = True
+
 def sincronizar_descripcion(indice):
     """Sincroniza el texto editado con los resultados almacenados"""
     nuevo_texto = st.session_state.get(f"txt_{indice}", "")
     if nuevo_texto and indice < len(st.session_state.resultados):
-        st.session_state.resultados[indice]['descripcion'] = nuevo_texto
+        st.session_state.resultados[indice].descripcion = nuevo_texto
 
 # ========== INTERFAZ ==========
 
@@ -107,11 +308,16 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Verificar API key
-if not GEMINI_API_KEY:
+if not BACKEND_DISPONIBLE:
     st.error("API key de Gemini no configurada. Configura GEMINI_API_KEY en los secrets de Streamlit.")
 
-# Obtener contadores (se muestran en el footer)
-contadores = obtener_contadores()
+# Una visita por sesión, contada en el servidor por el mismo agregador que las imágenes
+if 'visita_contada' not in st.session_state:
+    st.session_state.visita_contada = True
+    actualizar_contadores(visitas=1)
+
+# Obtener contadores (se muestran en el footer): desde la caché, sin esperar a JSONBin
+contadores = contadores_en_cache()
 
 # Mostrar alerta guardada después de rerun
 if st.session_state.mensaje_alerta:
@@ -127,18 +333,23 @@ if st.session_state.mensaje_alerta:
 with st.expander("Opciones avanzadas"):
     idioma = st.selectbox(
         "Idioma del texto alternativo",
-        options=["Español", "Inglés"],
+        options=list(IDIOMAS_OPCION),
         index=0,
         key="select_idioma"
     )
+    categorias_extra = st.multiselect(
+        "Categorías adicionales en la misma consulta",
+        options=["General", "Personas", "Vestuario", "Paisajes"],
+        key="select_categorias_extra"
+    )
     metadatos = st.selectbox(
         "Guardar en metadatos de imagen",
-        options=["Sí, guardar en EXIF", "No, solo renombrar"],
+        options=["Sí, guardar en metadatos", "No, solo renombrar"],
         index=0,
         key="select_exif"
     )
-usar_espanol = idioma == "Español"
-guardar_exif = metadatos == "Sí, guardar en EXIF"
+idiomas_codigo = IDIOMAS_OPCION[idioma]
+guardar_exif = metadatos == "Sí, guardar en metadatos"
 
 # CATEGORÍA DE ANÁLISIS
 if 'categoria_elegida' not in st.session_state:
@@ -165,6 +376,10 @@ with st.expander(f"Categoría de análisis: {cat_actual}"):
         )
 categoria_codigo = cat_actual.lower()
 
+# Cada (idioma, categoría) pedido es una variante; todas salen de una sola llamada por imagen
+categorias_codigo = [categoria_codigo] + [c.lower() for c in categorias_extra if c.lower() != categoria_codigo]
+variantes = [(i, c) for c in categorias_codigo for i in idiomas_codigo]
+
 # Cerrar expander y mover foco después de seleccionar categoría
 if st.session_state.categoria_cambio:
     st.session_state.categoria_cambio = False
@@ -197,7 +412,7 @@ if st.session_state.categoria_cambio:
 
 # SUBIR IMÁGENES
 st.markdown('<h2 id="subir-imagenes" tabindex="-1">Subir imágenes</h2>', unsafe_allow_html=True)
-st.markdown("Formatos: JPG, PNG, WEBP")
+st.markdown(f"Formatos: JPG, PNG, WEBP. Hasta {INGESTA_MAX_MB:.0f} MB por imagen.")
 
 # Mover foco a "Subir imágenes" después de limpiar resultados
 if st.session_state.foco_subir:
@@ -234,86 +449,164 @@ archivos = st.file_uploader(
     label_visibility="collapsed"
 )
 
-# Detectar cambio en archivos → iniciar procesamiento
+# Archivos descartados por la revisión de ingesta, con su motivo, mientras sigan subidos
+if archivos and st.session_state.rechazos:
+    st.warning("No se pueden analizar estos archivos:\n\n" + "\n".join(
+        f"- {escapar_markdown(nombre)}: {motivo}" for nombre, motivo in st.session_state.rechazos.values()
+    ))
+
+# Detectar cambio en archivos → iniciar (o reanudar) procesamiento
 if archivos:
     nombres_actuales = {f.name for f in archivos}
+    cambio = nombres_actuales != st.session_state.archivos_previos
+    if cambio:
+        # Solo se lee la cabecera: lo que excede los presupuestos no llega a decodificarse
+        st.session_state.rechazos = {}
+        for archivo in archivos:
+            try:
+                revisar(archivo.getvalue())
+            except ImagenRechazada as e:
+                st.session_state.rechazos[archivo.file_id] = (archivo.name, str(e))
+    archivos = [a for a in archivos if a.file_id not in st.session_state.rechazos]
+    rechazos = list(st.session_state.rechazos.values())
+    aviso_rechazos = ""
+    if rechazos:
+        aviso_rechazos = f" {len(rechazos)} {'archivo no se puede usar' if len(rechazos) == 1 else 'archivos no se pueden usar'}; el motivo aparece junto al botón de subir."
+
+    if cambio and not archivos:
+        st.session_state.archivos_previos = nombres_actuales
+        detener_trabajador()
+        descartar_zip()
+        vaciar_resultados()
+        st.session_state.trabajo = None
+        st.session_state.pendientes = []
+        st.session_state.procesando_indice = -1
+        st.session_state.error_procesamiento = False
+        st.session_state.mensaje_alerta = "No se puede analizar ninguna de las imágenes subidas." + aviso_rechazos
+        st.session_state.mostrar_visual = True
+        st.rerun()
 
-    if nombres_actuales != st.session_state.archivos_previos:
+    if cambio:
         st.session_state.archivos_previos = nombres_actuales
-        st.session_state.resultados = []
+        detener_trabajador()
+        descartar_zip()
+        vaciar_resultados()
         st.session_state.error_procesamiento = False
-        st.session_state.procesando_indice = 0
+        huellas = [huella_contenido(archivo.getvalue()) for archivo in archivos]
+        st.session_state.trabajo = {
+            "id": id_trabajo(huellas, variantes),
+            "huellas": huellas,
+            "variantes": variantes,
+        }
+
+        # Recuperar del diario lo que ya terminó antes de una recarga o caída
+        completadas = obtener_diario().completadas(st.session_state.trabajo["id"])
+        for pos, huella in enumerate(huellas):
+            if huella in completadas:
+                agregar_resultados(pos, archivos[pos].getvalue(), completadas[huella])
+        st.session_state.pendientes = [p for p, h in enumerate(huellas) if h not in completadas]
+
         total = len(archivos)
-        st.session_state.mensaje_alerta = f"Analizando {total} {'imagen' if total == 1 else 'imágenes'}, espera un momento."
+        recuperadas = total - len(st.session_state.pendientes)
+        if not st.session_state.pendientes:
+            st.session_state.procesando_indice = -1
+            st.session_state.mensaje_alerta = f"Listo. Se recuperaron {total} {'resultado' if total == 1 else 'resultados'} de un análisis anterior. Ya puedes descargar los resultados."
+            st.session_state.foco_resultados = True
+        else:
+            st.session_state.procesando_indice = recuperadas
+            st.session_state.mensaje_alerta = f"Analizando {total} {'imagen' if total == 1 else 'imágenes'}, espera un momento."
+            if recuperadas:
+                st.session_state.mensaje_alerta += f" Se recuperaron {recuperadas} de un análisis anterior."
+        st.session_state.mensaje_alerta += aviso_rechazos
         st.session_state.mostrar_visual = True
         st.rerun()
 
-# PROCESAR UNA IMAGEN A LA VEZ (con feedback NVDA entre cada una)
-if archivos and st.session_state.procesando_indice >= 0:
+def iniciar_trabajador(archivos):
+    """Arranca el procesamiento en segundo plano de las posiciones pendientes del lote"""
+    trabajo = st.session_state.trabajo
+    variantes_trabajo = tuple(tuple(v) for v in trabajo["variantes"])
+    indice_similitud = st.session_state.indices_similitud.setdefault(
+        variantes_trabajo, IndiceSimilitud(SIMILITUD_UMBRAL)
+    )
+    return TrabajadorLote(
+        trabajo,
+        {p: archivos[p].getvalue() for p in st.session_state.pendientes},
+        indice_similitud,
+        obtener_diario(),
+        # Cada cola del pipeline guarda lo que cabe en los hilos con el empaquetado
+        tam_bloque=GEMINI_HILOS * GEMINI_POR_SOLICITUD,
+        umbral_similitud=SIMILITUD_UMBRAL,
+        inicio=st.session_state.procesando_indice,
+        guardar_exif=guardar_exif,
+    ).iniciar()
+
+@st.fragment(run_every=PROGRESO_INTERVALO)
+def seguimiento_lote():
+    """Recoge lo que terminó el trabajador y anuncia el progreso sin rerun de toda la página"""
+    trabajador = st.session_state.trabajador
+    if trabajador is None:
+        return
+    # Si ya había terminado antes de recoger, esta es la última tanda
+    terminado = trabajador.terminado
+    nuevas = trabajador.recoger()
+    huellas = st.session_state.trabajo["huellas"]
+    for t in nuevas:
+        agregar_resultados(t.posicion, t.original, t.respuestas, t.miniatura, t.formato)
+        # Las descargas ya vienen codificadas desde la etapa final del pipeline
+        for descripcion, datos in t.descargas.items():
+            st.session_state.cache_descargas[(huellas[t.posicion], descripcion, trabajador.guardar_exif)] = datos
+    if nuevas:
+        aplicar_presupuesto(st.session_state.resultados, SESION_MEMORIA_MAX, SESION_DIRECTORIO,
+                            st.session_state.cache_descargas)
+
+    total = len(st.session_state.trabajo["huellas"])
+    hechas = trabajador.inicio + trabajador.hechas
+    st.session_state.procesando_indice = hechas
+
+    if terminado:
+        st.session_state.trabajador = None
+        st.session_state.anuncio_progreso = ""
+        st.session_state.pendientes = []
+        st.session_state.procesando_indice = -1
+        if trabajador.error:
+            st.session_state.error_procesamiento = True
+        elif hechas >= total:
+            actualizar_contadores(imagenes=total)
+            st.session_state.mensaje_alerta = f"Listo. {total} {'imagen procesada' if total == 1 else 'imágenes procesadas'}. Ya puedes descargar los resultados. Recuerda, la IA puede cometer errores, no te fíes completamente de los análisis."
+            fallidas = len(posiciones_fallidas())
+            if fallidas:
+                st.session_state.mensaje_alerta += f" {fallidas} {'imagen tuvo' if fallidas == 1 else 'imágenes tuvieron'} un error y se puede reintentar."
+            st.session_state.mostrar_visual = True
+            st.session_state.foco_resultados = True
+        # Una sola recarga completa al final, para mostrar los resultados
+        st.rerun()
+
+    st.progress(hechas / total, text=f"Procesando imagen {min(hechas + 1, total)} de {total}...")
+    colas = trabajador.profundidades()
+    st.caption(f"En cola: decodificar {colas['decodificar']} · Gemini {colas['gemini']} · codificar {colas['codificar']}")
+    if nuevas:
+        restantes = total - hechas
+        if restantes == 1:
+            st.session_state.anuncio_progreso = f"Imagen {hechas} de {total} procesada. Falta solo una más."
+        elif restantes:
+            st.session_state.anuncio_progreso = f"Imagen {hechas} de {total} procesada. Faltan {restantes} más."
+    # El mismo texto en cada consulta no cambia el DOM: el lector solo lee los avances
+    if st.session_state.anuncio_progreso:
+        st.success(st.session_state.anuncio_progreso)
+
+# PROCESAR EN SEGUNDO PLANO (el fragmento anuncia el progreso para NVDA)
+if archivos and st.session_state.procesando_indice >= 0 and not st.session_state.error_procesamiento:
     # Animación rasta durante procesamiento
     st.markdown('<style>.stApp::before{height:6px;background:repeating-linear-gradient(90deg,#228B22 0%,#FFD700 16%,#DC143C 33%,#228B22 50%);background-size:200% 100%;animation:rasta-slide 1.5s linear infinite;}</style>', unsafe_allow_html=True)
 
-    idx = st.session_state.procesando_indice
-    total = len(archivos)
-
-    if idx < total and not st.session_state.error_procesamiento:
-        # Barra de progreso visual
-        st.progress(idx / total, text=f"Procesando imagen {idx + 1} de {total}...")
-
-        try:
-            # Delay para rate limit
-            time.sleep(1)
-
-            idioma_codigo = "es" if usar_espanol else "en"
-            archivo = archivos[idx]
-            imagen = Image.open(archivo)
-            if imagen.mode != 'RGB':
-                imagen = imagen.convert('RGB')
-
-            resultado = describir_imagen(imagen, idioma_codigo, categoria_codigo)
-
-            nombre_nuevo = f"{limpiar_nombre(resultado['nombre'])}.jpg"
-            descripcion = resultado['descripcion']
-            exif = agregar_exif(imagen, descripcion) if guardar_exif else None
-
-            st.session_state.resultados.append({
-                "nombre": nombre_nuevo,
-                "descripcion": descripcion,
-                "imagen": imagen,
-                "exif": exif
-            })
-
-            st.session_state.procesando_indice = idx + 1
-
-            if idx + 1 < total:
-                restantes = total - (idx + 1)
-                if restantes == 1:
-                    st.session_state.mensaje_alerta = f"Imagen {idx+1} de {total} procesada. Falta solo una más."
-                else:
-                    st.session_state.mensaje_alerta = f"Imagen {idx+1} de {total} procesada. Faltan {restantes} más."
-                st.session_state.mostrar_visual = True
-            else:
-                # Todas procesadas
-                st.session_state.procesando_indice = -1
-                actualizar_contadores(imagenes=total)
-                st.session_state.mensaje_alerta = f"Listo. {total} {'imagen procesada' if total == 1 else 'imágenes procesadas'}. Ya puedes descargar los resultados. Recuerda, la IA puede cometer errores, no te fíes completamente de los análisis."
-                st.session_state.mostrar_visual = True
-                st.session_state.foco_resultados = True
+    if st.session_state.trabajador is None and st.session_state.pendientes:
+        st.session_state.trabajador = iniciar_trabajador(archivos)
+    seguimiento_lote()
 
-            st.rerun()
-
-        except Exception as e:
-            st.session_state.error_procesamiento = True
-            st.session_state.procesando_indice = -1
-            st.error(f"Error al procesar: {str(e)}")
-
-    elif st.session_state.error_procesamiento:
-        st.error("Hubo un error al procesar las imágenes.")
-        if st.button("Reintentar", type="primary", use_container_width=True):
-            st.session_state.error_procesamiento = False
-            st.session_state.procesando_indice = 0
-            st.session_state.resultados = []
-            st.rerun()
+# Tras un error, lo ya registrado en el diario se conserva: solo se reintenta lo pendiente
+if archivos and st.session_state.error_procesamiento:
+    st.error("Hubo un error al procesar las imágenes.")
+    st.button("Reintentar", type="primary", use_container_width=True, on_click=reanudar_trabajo)
 
 # RESULTADOS (solo cuando terminó el procesamiento)
 if st.session_state.resultados and st.session_state.procesando_indice < 0:
@@ -343,16 +636,39 @@ if st.session_state.resultados and st.session_state.procesando_indice < 0:
         </script>
         """, height=0)
 
+    # Consumo de Gemini del lote (las respuestas de la caché o de casi-duplicados no gastan)
+    trabajo = st.session_state.trabajo
+    consumo_lote = sumar_tokens(*(r.tokens for r in st.session_state.resultados))
+    if consumo_lote:
+        st.caption(f"Consumo de Gemini: {texto_tokens(consumo_lote)}. "
+                   f"Coste estimado: {costo_tokens(consumo_lote):.4f} USD.")
+        # Desglose por prompt (idioma y categoría) cuando el lote pidió varios
+        consumo_prompts = {}
+        for r in st.session_state.resultados:
+            if r.variante:
+                consumo_prompts[r.variante] = sumar_tokens(consumo_prompts.get(r.variante), r.tokens)
+        if len(consumo_prompts) > 1:
+            for (idioma_prompt, categoria), uso in consumo_prompts.items():
+                st.caption(f"{IDIOMAS_NOMBRE[idioma_prompt]}, {categoria.capitalize()}: {texto_tokens(uso)}.")
+
     # Resultados individuales
+    claves_descarga = set()
+    varias_variantes = trabajo is not None and len(trabajo["variantes"]) > 1
     for i, r in enumerate(st.session_state.resultados):
         col_thumb, col_info = st.columns([1, 3])
         with col_thumb:
-            st.image(r['imagen'], width=100, caption=f"Imagen {i+1}")
+            st.image(r.miniatura, width=100, caption=f"Imagen {i+1}")
         with col_info:
-            st.markdown(f"**{r['nombre']}**")
+            st.markdown(f"**{r.nombre}**")
+            etiqueta_variante = ""
+            if varias_variantes and r.variante:
+                etiqueta_variante = f" ({IDIOMAS_NOMBRE[r.variante[0]]}, {r.variante[1].capitalize()})"
+                st.caption(etiqueta_variante.strip(" ()"))
+            if r.tokens:
+                st.caption(texto_tokens(r.tokens).capitalize())
             texto_editado = st.text_area(
-                f"Texto alternativo imagen {i+1}",
-                value=r['descripcion'],
+                f"Texto alternativo imagen {i+1}{etiqueta_variante}",
+                value=r.descripcion,
                 key=f"txt_{i}",
                 height=100,
                 label_visibility="collapsed",
@@ -360,63 +676,76 @@ if st.session_state.resultados and st.session_state.procesando_indice < 0:
                 args=(i,)
             )
 
-        # Regenerar EXIF con el texto editado (usar descripcion sincronizada)
-        texto_para_descarga = st.session_state.resultados[i]['descripcion']
-        exif_actual = agregar_exif(r['imagen'], texto_para_descarga) if guardar_exif else None
-        buffer = imagen_a_bytes(r['imagen'], exif_actual)
+        claves_descarga.add((r.id, r.descripcion, guardar_exif))
 
         col1, col2 = st.columns([3, 1])
         with col1:
             st.download_button(
-                f"Descargar: {r['nombre']}",
-                data=buffer,
-                file_name=r['nombre'],
-                mime="image/jpeg",
+                f"Descargar: {r.nombre}",
+                data=lector_descarga(r, guardar_exif),
+                file_name=r.nombre,
+                mime=MIME_FORMATO.get(r.formato, "application/octet-stream"),
                 key=f"dl_{i}",
                 use_container_width=True,
                 on_click=marcar_descarga,
-                args=(r['nombre'],)
+                args=(r.nombre,)
             )
         with col2:
-            nombre_corto = r['nombre'][:20] + "..." if len(r['nombre']) > 23 else r['nombre']
+            nombre_corto = r.nombre[:20] + "..." if len(r.nombre) > 23 else r.nombre
             if st.button(f"Quitar: {nombre_corto}", key=f"rm_{i}", use_container_width=True, type="secondary", on_click=quitar_resultado, args=(i,)):
                 st.rerun()
 
         if i < len(st.session_state.resultados) - 1:
             st.markdown("---")
 
+    # Olvidar los bytes de versiones ya editadas o de imágenes quitadas
+    for clave in set(st.session_state.cache_descargas) - claves_descarga:
+        del st.session_state.cache_descargas[clave]
+    # Las descargas que dejó listas el pipeline también cuentan en el presupuesto de la sesión
+    aplicar_presupuesto(st.session_state.resultados, SESION_MEMORIA_MAX, SESION_DIRECTORIO,
+                        st.session_state.cache_descargas)
+
+    # Reintentar solo las imágenes con error; las correctas quedan en el diario
+    fallidas = len(posiciones_fallidas()) if archivos else 0
+    if fallidas:
+        st.markdown("---")
+        st.button(
+            f"Reintentar {'la imagen' if fallidas == 1 else f'las {fallidas} imágenes'} con error",
+            key="reintentar_fallidas",
+            type="primary",
+            use_container_width=True,
+            on_click=reanudar_trabajo
+        )
+
     # Descarga ZIP y limpiar
     st.markdown("---")
     if len(st.session_state.resultados) > 1:
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            nombres_usados = {}
-            for i, r in enumerate(st.session_state.resultados):
-                texto_actual = st.session_state.get(f"txt_{i}", r['descripcion'])
-                exif_zip = agregar_exif(r['imagen'], texto_actual) if guardar_exif else None
-                img_bytes = imagen_a_bytes(r['imagen'], exif_zip)
-                # Evitar nombres duplicados en el ZIP
-                nombre = r['nombre']
-                if nombre in nombres_usados:
-                    nombres_usados[nombre] += 1
-                    base, ext = nombre.rsplit('.', 1)
-                    nombre = f"{base}_{nombres_usados[nombre]}.{ext}"
-                else:
-                    nombres_usados[nombre] = 0
-                zf.writestr(nombre, img_bytes.getvalue())
-        zip_buffer.seek(0)
+        # El ZIP se construye bajo demanda; si los resultados cambian se descarta
+        zip_preparado = st.session_state.zip_preparado
+        if zip_preparado is not None and zip_preparado[0] != firma_zip(guardar_exif):
+            descartar_zip()
+            zip_preparado = None
 
         col1, col2 = st.columns([3, 1])
         with col1:
-            st.download_button(
-                "Descargar todo en ZIP",
-                data=zip_buffer.getvalue(),
-                file_name="garytext_imagenes.zip",
-                mime="application/zip",
-                key="dl_zip",
-                use_container_width=True,
-                on_click=marcar_descarga_zip
-            )
+            if zip_preparado is None:
+                st.button(
+                    "Preparar ZIP con todas las imágenes",
+                    key="prep_zip",
+                    use_container_width=True,
+                    on_click=preparar_zip,
+                    args=(guardar_exif,)
+                )
+            else:
+                st.download_button(
+                    "Descargar todo en ZIP",
+                    data=lector_zip(zip_preparado[1]),
+                    file_name="garytext_imagenes.zip",
+                    mime="application/zip",
+                    key="dl_zip",
+                    use_container_width=True,
+                    on_click=marcar_descarga_zip
+                )
         with col2:
             if st.button("Limpiar todo", use_container_width=True, type="secondary", on_click=limpiar_todo):
                 st.rerun()
@@ -424,12 +753,41 @@ if st.session_state.resultados and st.session_state.procesando_indice < 0:
         if st.button("Limpiar y procesar nuevas imágenes", use_container_width=True, type="secondary", on_click=limpiar_todo):
             st.rerun()
 
-# Footer con contadores
-st.markdown(f"""
-<div class="rasta-footer">
+# Panel de métricas oculto: solo con ?debug=metricas en la URL
+if st.query_params.get("debug") == "metricas":
+    with st.expander("Métricas del proceso", expanded=True):
+        datos_metricas = metricas.instantanea()
+        filas = [
+            {"etapa": etapa, "total": r["total"],
+             **{p: None if r[p] is None else round(r[p] * 1000, 1) for p in ("p50", "p95", "p99")}}
+            # Primero las etapas del pipeline en su orden, después las demás por nombre
+            for etapa, r in sorted(datos_metricas["etapas"].items(),
+                                   key=lambda e: (ETAPAS.index(e[0]) if e[0] in ETAPAS else len(ETAPAS), e[0]))
+        ]
+        st.caption("Duración por etapa en milisegundos")
+        st.dataframe(filas, use_container_width=True, hide_index=True)
+        st.json(datos_metricas["contadores"])
+        if datos_metricas["indicadores"]:
+            st.caption("Profundidad de las colas del pipeline")
+            st.json(datos_metricas["indicadores"])
+        if datos_metricas["tokens"]:
+            st.caption("Tokens de Gemini por categoría de prompt y coste estimado (USD)")
+            st.dataframe(
+                [{"categoría": categoria, **uso, "coste": round(costo_tokens(uso), 6)}
+                 for categoria, uso in sorted(datos_metricas["tokens"].items())],
+                use_container_width=True, hide_index=True
+            )
+        st.code(metricas.prometheus(), language="text")
+
+# Footer con contadores (se omiten hasta la primera lectura en segundo plano)
+linea_contadores = ""
+if contadores is not None:
+    linea_contadores = f"""
     <p style="margin-bottom: 0.3rem; font-size: 0.85rem;">
         <span aria-hidden="true">👁️</span> {contadores.get('visitas', 0):,} visitas · <span aria-hidden="true">📊</span> {contadores.get('imagenes', 0):,} imágenes analizadas
-    </p>
+    </p>"""
+st.markdown(f"""
+<div class="rasta-footer">{linea_contadores}
     <p style="margin-bottom: 0.5rem;">GaryText Pro v0.1 - Por Gary Dev</p>
     <p style="font-size: 0.9rem; margin-bottom: 0.5rem;">
         Si te ha parecido útil esta aplicación, no dudes en donarme un café
@@ -440,37 +798,13 @@ st.markdown(f"""
 </div>
 """, unsafe_allow_html=True)
 
-# Contador de visitas con JavaScript (al final para no interferir con lectores de pantalla)
-components.html(f"""
-<script>
-(function() {{
-    try {{ if (window.frameElement) {{
-        window.frameElement.setAttribute('aria-hidden', 'true');
-        window.frameElement.tabIndex = -1;
-        window.frameElement.title = '';
-    }} }} catch(e) {{}}
-
-    const BIN_ID = "{JSONBIN_BIN_ID}";
-    const API_KEY = "{JSONBIN_API_KEY}";
-    const STORAGE_KEY = "garytext_visitado";
-
-    if (!localStorage.getItem(STORAGE_KEY)) {{
-        localStorage.setItem(STORAGE_KEY, Date.now().toString());
-        fetch("https://api.jsonbin.io/v3/b/" + BIN_ID + "/latest", {{
-            headers: {{ "X-Master-Key": API_KEY }}
-        }})
-        .then(res => res.json())
-        .then(data => {{
-            const datos = data.record;
-            datos.visitas = (datos.visitas || 0) + 1;
-            return fetch("https://api.jsonbin.io/v3/b/" + BIN_ID, {{
-                method: "PUT",
-                headers: {{ "Content-Type": "application/json", "X-Master-Key": API_KEY }},
-                body: JSON.stringify(datos)
-            }});
-        }})
-        .catch(err => console.log("Error contador:", err));
-    }}
-}})();
-</script>
-""", height=0)
+# Tiempo de pintado de cada ejecución y, en frío, el arranque completo
+render = time.perf_counter() - INICIO_SCRIPT
+metricas.observar("render", render)
+if EN_FRIO:
+    metricas.observar("arranque_importaciones", IMPORTACIONES)
+    metricas.observar("arranque_primer_render", render)
+    log.info(f"Arranque en frío: importaciones {IMPORTACIONES * 1000:.0f} ms, primer render {render * 1000:.0f} ms")
+
+# Con la página ya pintada, el SDK de Gemini se carga en segundo plano
+precalentar()
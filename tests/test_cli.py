@@ -0,0 +1,24 @@
+"""Recorrido del directorio de entrada de la CLI"""
+
+import os
+
+from utils.cli import recorrer_imagenes
+
+
+def _crear(ruta):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    open(ruta, "wb").close()
+
+
+def test_no_recorre_la_salida_dentro_de_la_entrada(tmp_path):
+    entrada, salida = tmp_path / "fotos", tmp_path / "fotos" / "salida"
+    for nombre in ("a.jpg", "b/c.PNG", "b/notas.txt", "salida/vieja.jpg"):
+        _crear(str(entrada / nombre))
+
+    vistas = []
+    for ruta in recorrer_imagenes(str(entrada), excluir=str(salida)):
+        vistas.append(os.path.relpath(ruta, entrada))
+        # Lo que se escribe en la salida durante el recorrido tampoco aparece
+        _crear(str(salida / "b" / f"copia_{len(vistas)}.jpg"))
+
+    assert vistas == ["a.jpg", os.path.join("b", "c.PNG")]
@@ -0,0 +1,95 @@
+"""AgregadorDiferido contra un servidor local que imita la API de JSONBin"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from utils.contadores import AgregadorDiferido, AlmacenJSONBin, AlmacenLocal
+
+BIN_ID = "bin-de-prueba"
+API_KEY = "clave-de-prueba"
+
+
+class _JSONBinFalso(BaseHTTPRequestHandler):
+    """GET /b/<id>/latest y PUT /b/<id> sobre el `registro` del servidor; `fallar_put` responde 500"""
+
+    def _responder(self, estado, cuerpo=None):
+        datos = json.dumps(cuerpo or {}).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        if self.path != f"/b/{BIN_ID}/latest" or self.headers.get("X-Master-Key") != API_KEY:
+            return self._responder(404)
+        self._responder(200, {"record": self.server.registro})
+
+    def do_PUT(self):
+        if self.path != f"/b/{BIN_ID}" or self.headers.get("X-Master-Key") != API_KEY:
+            return self._responder(404)
+        cuerpo = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.escrituras += 1
+        if self.server.fallar_put:
+            return self._responder(500)
+        self.server.registro = cuerpo
+        self._responder(200, {"record": cuerpo})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servidor():
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _JSONBinFalso)
+    servidor.registro = {"imagenes": 10, "visitas": 5}
+    servidor.escrituras = 0
+    servidor.fallar_put = False
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def agregador(servidor, tmp_path):
+    url = f"http://127.0.0.1:{servidor.server_address[1]}"
+    remoto = AlmacenJSONBin(BIN_ID, API_KEY, url_base=url, sesion=requests.Session())
+    # Intervalo largo: los volcados se piden a mano con vaciar()
+    agregador = AgregadorDiferido(remoto, AlmacenLocal(str(tmp_path / "pendientes.sqlite3"), tabla="pendientes"),
+                                  intervalo=3600)
+    yield agregador
+    servidor.fallar_put = False
+    agregador.detener()
+
+
+def test_vuelca_los_incrementos_acumulados_en_una_escritura(servidor, agregador):
+    agregador.sumar({"imagenes": 3, "visitas": 1})
+    agregador.sumar({"imagenes": 2, "visitas": 0})
+    assert servidor.escrituras == 0
+
+    assert agregador.vaciar() == {"imagenes": 15, "visitas": 6}
+    assert servidor.registro == {"imagenes": 15, "visitas": 6}
+    assert servidor.escrituras == 1
+    # Sin pendientes no se vuelve a escribir
+    assert agregador.vaciar() is None
+    assert servidor.escrituras == 1
+
+
+def test_un_put_fallido_devuelve_los_incrementos_a_la_cola(servidor, agregador):
+    agregador.sumar({"imagenes": 4, "visitas": 2})
+    servidor.fallar_put = True
+
+    assert agregador.vaciar() is None
+    assert servidor.registro == {"imagenes": 10, "visitas": 5}
+    assert agregador.pendientes.leer() == {"imagenes": 4, "visitas": 2}
+
+    # Lo que llega mientras tanto se suma a lo devuelto y sale en el siguiente volcado
+    agregador.sumar({"imagenes": 1, "visitas": 0})
+    servidor.fallar_put = False
+    assert agregador.vaciar() == {"imagenes": 15, "visitas": 7}
+    assert agregador.pendientes.leer() == {"imagenes": 0, "visitas": 0}
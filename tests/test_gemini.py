@@ -0,0 +1,117 @@
+"""Paquetes y variantes: separación de la respuesta, reenvío de lo que falta y una consulta de caché por imagen"""
+
+import pytest
+
+import utils.gemini as gemini
+from utils.backends import Respuesta
+from utils.cache import CacheDescripciones
+from utils.imagen import BytesEnvio
+from utils.reintentos import Disyuntor
+
+
+class _BackendGuionado:
+    """Devuelve los textos de `guion` en orden y anota cuántas imágenes llevaba cada solicitud"""
+
+    nombre = "guion"
+
+    def __init__(self, *guion):
+        self.guion = list(guion)
+        self.imagenes = []
+
+    def generar(self, partes, timeout=None):
+        self.imagenes.append(sum(isinstance(p, dict) for p in partes))
+        return Respuesta(self.guion.pop(0), {"entrada": 100, "salida": 10})
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = CacheDescripciones(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(gemini, "BACKEND_DISPONIBLE", True)
+    monkeypatch.setattr(gemini, "obtener_cache", lambda: cache)
+    monkeypatch.setattr(gemini, "obtener_disyuntor", lambda: Disyuntor())
+    return cache
+
+
+def _backend(monkeypatch, *guion):
+    backend = _BackendGuionado(*guion)
+    monkeypatch.setattr(gemini, "obtener_backend", lambda: backend)
+    return backend
+
+
+def _imagenes(n):
+    return [BytesEnvio(f"jpeg {i}".encode()) for i in range(n)]
+
+
+def _bloque(k, nombre, marca="IMAGEN"):
+    return f"[{marca} {k}]\nNOMBRE: {nombre}\nDESCRIPCION: Descripción de {nombre}."
+
+
+def test_separar_bloques_por_marca():
+    texto = "Preámbulo\n[IMAGEN 2]\nNOMBRE: b\n\n[IMAGEN 1]\nNOMBRE: a\n[IMAGEN 7]\nNOMBRE: fuera\n[IMAGEN 3]\n"
+    assert gemini._separar_bloques(texto, 3, gemini._MARCA_IMAGEN) == ["NOMBRE: a", "NOMBRE: b", None]
+    assert gemini.separar_variantes("[VARIANTE 1]\nNAME: x", 2) == ["NAME: x", None]
+
+
+@pytest.mark.parametrize("bloque, valido", [
+    ("NOMBRE: a\nDESCRIPCION: b", True),
+    ("name: a\ndescription: b", True),
+    ("NOMBRE: a", False),
+    ("Solo texto sin formato", False),
+    (None, False),
+])
+def test_bloque_valido(bloque, valido):
+    assert gemini._bloque_valido(bloque) == valido
+
+
+def test_paquete_reenvia_los_bloques_ausentes_o_mal_formados(cache, monkeypatch):
+    # La imagen 2 llega sin DESCRIPCION y la 3 no llega: se piden solas, en orden
+    backend = _backend(
+        monkeypatch,
+        _bloque(1, "uno") + "\n[IMAGEN 2]\nNOMBRE: dos",
+        "NOMBRE: dos\nDESCRIPCION: Descripción de dos.",
+        "NOMBRE: tres\nDESCRIPCION: Descripción de tres.",
+    )
+    resultados = gemini.describir_imagenes_paquete(_imagenes(3), huellas=["h1", "h2", "h3"])
+
+    assert [r["nombre"] for r in resultados] == ["uno", "dos", "tres"]
+    assert backend.imagenes == [3, 1, 1]
+    # Los reenvíos suman sus tokens a la parte del paquete que les tocaba
+    assert resultados[0]["tokens"]["entrada"] == 34
+    assert resultados[1]["tokens"]["entrada"] == 33 + 100
+    # Cada imagen se consultó una sola vez en la caché y quedó guardada
+    assert cache.estadisticas() == {"aciertos": 0, "fallos": 3, "entradas": 3}
+
+
+def test_paquete_con_una_sola_imagen_sin_cache(cache, monkeypatch):
+    backend = _backend(monkeypatch, _bloque(1, "uno"), "NOMBRE: dos\nDESCRIPCION: Descripción de dos.")
+    gemini.describir_imagenes_paquete(_imagenes(1), huellas=["h1"])
+
+    resultados = gemini.describir_imagenes_paquete(_imagenes(2), huellas=["h1", "h2"])
+    assert [r["nombre"] for r in resultados] == ["uno", "dos"]
+    assert resultados[0]["bytes_enviados"] == 0
+    assert backend.imagenes == [1, 1]
+    assert cache.estadisticas() == {"aciertos": 1, "fallos": 2, "entradas": 2}
+
+
+def test_variantes_pide_por_separado_la_que_falta(cache, monkeypatch):
+    variantes = [("es", "general"), ("en", "general"), ("es", "ecommerce")]
+    backend = _backend(
+        monkeypatch,
+        _bloque(1, "uno", "VARIANTE") + "\n" + _bloque(3, "tres", "VARIANTE"),
+        "NAME: two\nDESCRIPTION: Description of two.",
+    )
+    resultados = gemini.describir_imagen_variantes(BytesEnvio(b"jpeg"), variantes, huella="h")
+
+    assert [r["nombre"] for r in resultados] == ["uno", "two", "tres"]
+    assert backend.imagenes == [1, 1]
+    assert cache.estadisticas() == {"aciertos": 0, "fallos": 3, "entradas": 3}
+
+
+def test_sin_backend_todas_las_rutas_devuelven_dicts_de_error(monkeypatch):
+    monkeypatch.setattr(gemini, "BACKEND_DISPONIBLE", False)
+    resultados = [
+        gemini.describir_imagen(BytesEnvio(b"jpeg")),
+        *gemini.describir_imagen_variantes(BytesEnvio(b"jpeg"), [("es", "general"), ("en", "general")]),
+        *gemini.describir_imagenes_paquete(_imagenes(2)),
+    ]
+    assert all(r["nombre"] == "error" and "API key" in r["descripcion"] for r in resultados)
@@ -0,0 +1,125 @@
+"""Ida y vuelta de con_descripcion: mismo formato, mismos píxeles y metadatos sin duplicar"""
+
+import io
+import struct
+
+import pytest
+from PIL import Image, ImageChops
+
+from utils.imagen import con_descripcion, formato_de
+
+TEXTO = 'Montaña nevada <al> atardecer & lago "azul"'
+OTRO_TEXTO = "Bosque de pinos cubierto de niebla al amanecer"
+
+CASOS = {
+    "jpeg": ("JPEG", "RGB", {"quality": 90}),
+    "png_rgb": ("PNG", "RGB", {}),
+    "png_rgba": ("PNG", "RGBA", {}),
+    "webp_con_perdida": ("WEBP", "RGB", {"quality": 80}),
+    "webp_sin_perdida": ("WEBP", "RGB", {"lossless": True}),
+    "webp_rgba_sin_perdida": ("WEBP", "RGBA", {"lossless": True}),
+    "webp_rgba_con_perdida": ("WEBP", "RGBA", {"quality": 80}),
+}
+
+
+def _original(formato, modo, opciones):
+    # Tamaño impar para probar el relleno de chunks RIFF y las dimensiones del lienzo
+    imagen = Image.new(modo, (301, 199), (10, 200, 30, 128) if modo == "RGBA" else (10, 200, 30))
+    imagen.putpixel((5, 5), (255, 0, 0, 255) if modo == "RGBA" else (255, 0, 0))
+    buffer = io.BytesIO()
+    imagen.save(buffer, formato, **opciones)
+    return buffer.getvalue()
+
+
+def _abrir(datos):
+    imagen = Image.open(io.BytesIO(datos))
+    imagen.load()
+    return imagen
+
+
+def _xmp(imagen):
+    xmp = imagen.info.get("xmp") or imagen.info.get("XML:com.adobe.xmp") or b""
+    return xmp.decode("utf-8") if isinstance(xmp, bytes) else xmp
+
+
+def _chunks_riff(datos):
+    chunks = []
+    pos = 12
+    while pos + 8 <= len(datos):
+        tipo = datos[pos:pos + 4]
+        largo = struct.unpack("<I", datos[pos + 4:pos + 8])[0]
+        chunks.append((tipo, datos[pos + 8:pos + 8 + largo]))
+        pos += 8 + largo + (largo % 2)
+    return chunks
+
+
+@pytest.fixture(params=list(CASOS), ids=list(CASOS))
+def original(request):
+    return _original(*CASOS[request.param])
+
+
+def test_conserva_formato_y_pixeles(original):
+    salida = con_descripcion(original, TEXTO)
+    antes, despues = _abrir(original), _abrir(salida)
+
+    assert formato_de(salida) == formato_de(original)
+    assert despues.mode == antes.mode
+    assert despues.size == antes.size
+    assert ImageChops.difference(antes.convert("RGBA"), despues.convert("RGBA")).getbbox() is None
+
+
+def test_escribe_el_texto_en_los_metadatos(original):
+    imagen = _abrir(con_descripcion(original, TEXTO))
+    xmp = _xmp(imagen)
+
+    assert xmp.count("<?xpacket begin") == 1
+    assert "&lt;al&gt; atardecer &amp; lago" in xmp
+    assert "Iptc4xmpCore:AltTextAccessibility" in xmp
+    if imagen.format == "PNG":
+        assert imagen.text["Description"] == TEXTO
+    else:
+        descripcion = imagen.getexif().get(0x010E)
+        assert descripcion is not None
+        assert descripcion.encode("latin-1").decode("utf-8") == TEXTO
+
+
+def test_reetiquetar_sustituye_sin_duplicar(original):
+    primera = con_descripcion(original, TEXTO)
+    segunda = con_descripcion(primera, OTRO_TEXTO)
+    imagen = _abrir(segunda)
+    xmp = _xmp(imagen)
+
+    assert xmp.count("<?xpacket begin") == 1
+    assert OTRO_TEXTO in xmp and "atardecer" not in xmp
+    if imagen.format == "PNG":
+        assert imagen.text["Description"] == OTRO_TEXTO
+    # Poner otra vez el mismo texto no hace crecer el archivo
+    assert len(con_descripcion(segunda, OTRO_TEXTO)) == len(segunda)
+    assert ImageChops.difference(_abrir(original).convert("RGBA"), imagen.convert("RGBA")).getbbox() is None
+
+
+def test_sin_texto_devuelve_el_original(original):
+    assert con_descripcion(original, None) == original
+
+
+@pytest.mark.parametrize("caso", [c for c in CASOS if c.startswith("webp")])
+def test_webp_vp8x_coherente(caso):
+    original = _original(*CASOS[caso])
+    salida = con_descripcion(con_descripcion(original, TEXTO), OTRO_TEXTO)
+    chunks = _chunks_riff(salida)
+    tipos = [tipo for tipo, _ in chunks]
+
+    assert struct.unpack("<I", salida[4:8])[0] == len(salida) - 8
+    assert tipos[0] == b"VP8X"
+    assert tipos.count(b"EXIF") == 1 and tipos.count(b"XMP ") == 1
+    # El flujo de imagen es el mismo, byte a byte
+    flujo = [datos for tipo, datos in _chunks_riff(original) if tipo in (b"VP8 ", b"VP8L")]
+    assert flujo == [datos for tipo, datos in chunks if tipo in (b"VP8 ", b"VP8L")]
+
+    vp8x = chunks[0][1]
+    banderas = vp8x[0]
+    assert banderas & 0x04 and banderas & 0x08
+    assert bool(banderas & 0x10) == (CASOS[caso][1] == "RGBA")
+    ancho = int.from_bytes(vp8x[4:7], "little") + 1
+    alto = int.from_bytes(vp8x[7:10], "little") + 1
+    assert (ancho, alto) == (301, 199)
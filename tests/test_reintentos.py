@@ -0,0 +1,120 @@
+"""PoliticaReintentos y Disyuntor: reintentos por tipo de error, plazo y apertura/cierre del circuito"""
+
+import time
+
+import pytest
+from google.api_core import exceptions as gexc
+
+from utils.reintentos import CircuitoAbierto, Disyuntor, PlazoAgotado, PoliticaReintentos
+
+
+class _LimitadorLento:
+    """Entrega la ficha tras `espera` s, como un cubo compartido ya vacío"""
+
+    def __init__(self, espera):
+        self.espera = espera
+        self.pausas = []
+
+    def adquirir(self):
+        time.sleep(self.espera)
+        return self.espera
+
+    def pausar(self, segundos):
+        self.pausas.append(segundos)
+
+
+def _fallar(*errores, resultado="ok"):
+    """Operación que lanza `errores` en orden y luego devuelve `resultado`; guarda los timeouts recibidos"""
+    pendientes = list(errores)
+
+    def operacion(restante):
+        operacion.llamadas.append(restante)
+        if pendientes:
+            raise pendientes.pop(0)
+        return resultado
+    operacion.llamadas = []
+    return operacion
+
+
+def test_reintenta_los_transitorios_y_no_los_permanentes():
+    politica = PoliticaReintentos(intentos=3, base=0)
+    operacion = _fallar(gexc.ServiceUnavailable("503"), gexc.InternalServerError("500"))
+    assert politica.ejecutar(operacion) == "ok"
+    assert len(operacion.llamadas) == 3
+
+    operacion = _fallar(gexc.InvalidArgument("imagen no válida"))
+    with pytest.raises(gexc.InvalidArgument):
+        politica.ejecutar(operacion)
+    assert len(operacion.llamadas) == 1
+
+
+def test_un_429_pausa_el_limitador_compartido():
+    limitador = _LimitadorLento(0)
+    operacion = _fallar(gexc.ResourceExhausted("429"))
+    assert PoliticaReintentos(intentos=2, base=0).ejecutar(operacion, limitador) == "ok"
+    assert len(limitador.pausas) == 1
+
+
+def test_no_envia_si_la_espera_por_la_ficha_agota_el_plazo():
+    disyuntor = Disyuntor(umbral=1, enfriamiento=0.05)
+    disyuntor.fallo()
+    time.sleep(0.06)
+    operacion = _fallar()
+
+    with pytest.raises(PlazoAgotado):
+        PoliticaReintentos(plazo=0.1).ejecutar(operacion, _LimitadorLento(0.2), disyuntor)
+    assert operacion.llamadas == []
+    # La prueba del semiabierto no llegó a salir: la siguiente solicitud puede hacerla
+    disyuntor.permitir()
+
+
+def test_el_timeout_es_el_plazo_que_queda():
+    operacion = _fallar()
+    PoliticaReintentos(plazo=5).ejecutar(operacion, _LimitadorLento(0.1))
+    assert 4.5 < operacion.llamadas[0] < 4.95
+
+
+def test_no_reintenta_si_la_espera_no_cabe_en_el_plazo():
+    politica = PoliticaReintentos(intentos=5, base=10, maximo=10, plazo=0.5)
+    operacion = _fallar(gexc.ServiceUnavailable("Retry in 5s"))
+    with pytest.raises(gexc.ServiceUnavailable):
+        politica.ejecutar(operacion)
+    assert len(operacion.llamadas) == 1
+
+
+def test_el_disyuntor_se_abre_y_se_cierra():
+    disyuntor = Disyuntor(umbral=2, enfriamiento=0.1)
+    politica = PoliticaReintentos(intentos=1)
+    for _ in range(2):
+        with pytest.raises(gexc.ServiceUnavailable):
+            politica.ejecutar(_fallar(gexc.ServiceUnavailable("503")), disyuntor=disyuntor)
+    assert disyuntor.abierto
+
+    # Abierto: no se llama a la API
+    operacion = _fallar()
+    with pytest.raises(CircuitoAbierto):
+        politica.ejecutar(operacion, disyuntor=disyuntor)
+    assert operacion.llamadas == []
+
+    # Tras el enfriamiento pasa una sola prueba; si falla se vuelve a abrir
+    time.sleep(0.11)
+    assert not disyuntor.abierto
+    with pytest.raises(gexc.ServiceUnavailable):
+        politica.ejecutar(_fallar(gexc.ServiceUnavailable("503")), disyuntor=disyuntor)
+    assert disyuntor.abierto
+
+    # Si la prueba sale bien se cierra del todo
+    time.sleep(0.11)
+    disyuntor.permitir()
+    with pytest.raises(CircuitoAbierto):
+        disyuntor.permitir()
+    disyuntor.exito()
+    assert politica.ejecutar(_fallar(), disyuntor=disyuntor) == "ok"
+    assert not disyuntor.abierto
+
+
+def test_los_errores_permanentes_no_abren_el_circuito():
+    disyuntor = Disyuntor(umbral=1)
+    with pytest.raises(gexc.PermissionDenied):
+        PoliticaReintentos(intentos=1).ejecutar(_fallar(gexc.PermissionDenied("clave")), disyuntor=disyuntor)
+    assert not disyuntor.abierto
@@ -0,0 +1,214 @@
+"""Módulo de backends: quién genera el texto (Gemini, un falso local o una grabación)
+
+Todos exponen `generar(partes, timeout)` y devuelven una Respuesta con el texto
+y los tokens consumidos; `partes` es la misma lista que recibe `generate_content`
+(textos y blobs `{"mime_type", "data"}`).
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from google.api_core import exceptions as gexc
+
+_MARCA_IMAGEN = re.compile(r'^\[IMAGEN\s+(\d+)\]$', re.IGNORECASE)
+_MARCA_VARIANTE = re.compile(r'^\s*\[VARIANTE\s+(\d+)\]\s*$', re.IGNORECASE | re.MULTILINE)
+
+RESPUESTAS_FALSAS = [
+    ("Paisaje de montaña", "Montañas nevadas bajo un cielo despejado con un lago en primer plano."),
+    ("Retrato en exterior", "Persona sonriente al aire libre con árboles desenfocados al fondo."),
+    ("Plato de comida", "Plato con verduras asadas y arroz sobre una mesa de madera."),
+    ("Calle de ciudad", "Calle con edificios antiguos, coches aparcados y peatones caminando."),
+]
+
+
+# Tokens que Gemini cobra por imagen de hasta 384 px (las mayores se trocean en teselas de 768)
+TOKENS_IMAGEN = 258
+
+
+def estimar_tokens(texto):
+    """Aproximación de ~4 caracteres por token, para el backend falso y el informe de prompts"""
+    return max(1, round(len(texto) / 4)) if texto else 0
+
+
+class Respuesta:
+    """Texto generado y `uso`: dict de tokens (entrada, salida y, si se conocen, texto e imagen)"""
+
+    __slots__ = ("texto", "uso")
+
+    def __init__(self, texto, uso=None):
+        self.texto = texto
+        self.uso = uso or {}
+
+
+def uso_gemini(metadatos):
+    """Tokens de `usage_metadata`; el desglose por modalidad solo existe en versiones recientes"""
+    if metadatos is None:
+        return {}
+    uso = {
+        "entrada": int(getattr(metadatos, "prompt_token_count", 0) or 0),
+        "salida": int(getattr(metadatos, "candidates_token_count", 0) or 0),
+    }
+    for detalle in getattr(metadatos, "prompt_tokens_details", None) or []:
+        modalidad = str(getattr(detalle, "modality", "")).rsplit(".", 1)[-1].upper()
+        if modalidad in ("TEXT", "IMAGE"):
+            campo = "texto" if modalidad == "TEXT" else "imagen"
+            uso[campo] = uso.get(campo, 0) + int(detalle.token_count)
+    return uso
+
+
+def _huella_partes(partes):
+    """Hash estable de una solicitud: mismo prompt y mismas imágenes, misma clave"""
+    h = hashlib.sha256()
+    for parte in partes:
+        if isinstance(parte, dict):
+            h.update(parte.get("mime_type", "").encode('utf-8'))
+            h.update(parte["data"])
+        else:
+            h.update(str(parte).encode('utf-8'))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class Backend:
+    """Interfaz: generar(partes, timeout) -> Respuesta"""
+
+    nombre = "base"
+
+    def generar(self, partes, timeout=None):
+        raise NotImplementedError
+
+
+class BackendGemini(Backend):
+    """Llamada real a Gemini con un GenerativeModel ya configurado"""
+
+    nombre = "gemini"
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+
+    def generar(self, partes, timeout=None):
+        opciones = {"timeout": timeout} if timeout else None
+        respuesta = self.modelo.generate_content(partes, request_options=opciones)
+        return Respuesta(respuesta.text.strip(), uso_gemini(getattr(respuesta, "usage_metadata", None)))
+
+
+class BackendFalso(Backend):
+    """Backend local sin red para pruebas de carga y benchmarks.
+
+    La latencia sigue una lognormal de mediana `latencia` s y dispersión
+    `dispersion`; `tasa_error` y `tasa_429` inyectan caídas (503) y cuota
+    agotada (429). La respuesta sale de `respuestas` según el hash de cada
+    imagen, así que es determinista, y respeta las marcas [IMAGEN k] y
+    [VARIANTE n] de las solicitudes empaquetadas o combinadas. Los tokens se
+    estiman: ~4 caracteres por token de texto y TOKENS_IMAGEN por imagen.
+    """
+
+    nombre = "falso"
+
+    def __init__(self, latencia=1.0, dispersion=0.3, tasa_error=0.0, tasa_429=0.0,
+                 respuestas=None, semilla=None, retraso_429=1.0):
+        self.latencia = float(latencia)
+        self.dispersion = float(dispersion)
+        self.tasa_error = float(tasa_error)
+        self.tasa_429 = float(tasa_429)
+        self.retraso_429 = float(retraso_429)
+        self.respuestas = list(respuestas or RESPUESTAS_FALSAS)
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.llamadas = 0
+
+    def _sortear(self):
+        with self._lock:
+            self.llamadas += 1
+            espera = self.latencia * math.exp(self._azar.gauss(0, self.dispersion)) if self.latencia else 0.0
+            return espera, self._azar.random()
+
+    def _bloque(self, datos, variante=None):
+        indice = int(hashlib.sha256(datos).hexdigest(), 16) % len(self.respuestas)
+        nombre, descripcion = self.respuestas[indice]
+        if variante:
+            nombre = f"{nombre} {variante}"
+        return f"NOMBRE: {nombre}\nDESCRIPCION: {descripcion}"
+
+    def _respuesta(self, partes):
+        textos = [p for p in partes if isinstance(p, str)]
+        imagenes = [p["data"] for p in partes if isinstance(p, dict)]
+        variantes = len(_MARCA_VARIANTE.findall(textos[0])) if textos else 0
+        if any(_MARCA_IMAGEN.match(t.strip()) for t in textos):
+            return "\n\n".join(f"[IMAGEN {k}]\n{self._bloque(datos)}" for k, datos in enumerate(imagenes, 1))
+        datos = imagenes[0] if imagenes else b""
+        if variantes:
+            return "\n\n".join(f"[VARIANTE {n}]\n{self._bloque(datos, n)}" for n in range(1, variantes + 1))
+        return self._bloque(datos)
+
+    def generar(self, partes, timeout=None):
+        espera, suerte = self._sortear()
+        if timeout is not None and espera > timeout:
+            time.sleep(timeout)
+            raise gexc.DeadlineExceeded("Tiempo de espera agotado (backend falso)")
+        time.sleep(espera)
+        if suerte < self.tasa_429:
+            raise gexc.ResourceExhausted(f"Cuota agotada (backend falso). Please retry in {self.retraso_429}s")
+        if suerte < self.tasa_429 + self.tasa_error:
+            raise gexc.ServiceUnavailable("Servicio no disponible (backend falso)")
+        texto = self._respuesta(partes)
+        imagenes = sum(isinstance(p, dict) for p in partes)
+        entrada_texto = sum(estimar_tokens(p) for p in partes if isinstance(p, str))
+        return Respuesta(texto, {
+            "entrada": entrada_texto + imagenes * TOKENS_IMAGEN,
+            "salida": estimar_tokens(texto),
+            "texto": entrada_texto,
+            "imagen": imagenes * TOKENS_IMAGEN,
+        })
+
+
+class BackendGrabacion(Backend):
+    """Graba las respuestas de otro backend en un JSONL o las reproduce sin llamar a nadie.
+
+    En modo "grabar" cada respuesta correcta se añade a `ruta` con la huella de
+    su solicitud y sus tokens; en modo "reproducir" se devuelve la respuesta
+    grabada y una solicitud desconocida es un error.
+    """
+
+    nombre = "grabacion"
+
+    def __init__(self, ruta, modo="reproducir", interno=None):
+        if modo not in ("grabar", "reproducir"):
+            raise ValueError(f"Modo de grabación desconocido: {modo}")
+        if modo == "grabar" and interno is None:
+            raise ValueError("El modo grabar necesita un backend interno")
+        self.ruta = ruta
+        self.modo = modo
+        self.interno = interno
+        self._lock = threading.Lock()
+        self._grabadas = {}
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                for linea in f:
+                    if linea.strip():
+                        registro = json.loads(linea)
+                        # Las grabaciones anteriores al recuento de tokens no traen "uso"
+                        self._grabadas[registro["huella"]] = Respuesta(registro["texto"], registro.get("uso"))
+
+    def generar(self, partes, timeout=None):
+        huella = _huella_partes(partes)
+        if self.modo == "reproducir":
+            with self._lock:
+                respuesta = self._grabadas.get(huella)
+            if respuesta is None:
+                raise LookupError(f"No hay respuesta grabada para la solicitud {huella[:12]}")
+            return respuesta
+
+        respuesta = self.interno.generar(partes, timeout)
+        with self._lock:
+            self._grabadas[huella] = respuesta
+            with open(self.ruta, "a", encoding="utf-8") as f:
+                registro = {"huella": huella, "texto": respuesta.texto, "uso": respuesta.uso}
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        return respuesta
@@ -0,0 +1,76 @@
+"""Módulo de caché: descripciones persistentes en SQLite direccionadas por contenido"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def huella_contenido(datos):
+    """Hash SHA-256 de los bytes originales de la imagen"""
+    return hashlib.sha256(datos).hexdigest()
+
+
+def clave_cache(huella, idioma, categoria, modelo, version_prompt):
+    """Clave única: misma imagen + mismo prompt + mismo modelo → misma descripción"""
+    return "|".join((huella, idioma, categoria, modelo, version_prompt))
+
+
+class CacheDescripciones:
+    """Caché LRU en SQLite con límite de entradas y contadores de aciertos/fallos"""
+
+    def __init__(self, ruta, max_entradas=5000):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS descripciones ("
+            "clave TEXT PRIMARY KEY, resultado TEXT NOT NULL, ultimo_uso REAL NOT NULL)"
+        )
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ultimo_uso ON descripciones (ultimo_uso)"
+        )
+        self._conexion.commit()
+
+    def obtener(self, clave):
+        """Devuelve el resultado guardado o None, y actualiza su uso para el LRU"""
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT resultado FROM descripciones WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+            self._conexion.execute(
+                "UPDATE descripciones SET ultimo_uso = ? WHERE clave = ?", (time.time(), clave)
+            )
+            self._conexion.commit()
+        return json.loads(fila[0])
+
+    def guardar(self, clave, resultado):
+        """Guarda un resultado y expulsa las entradas menos usadas si se supera el límite"""
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO descripciones (clave, resultado, ultimo_uso) VALUES (?, ?, ?)",
+                (clave, json.dumps(resultado, ensure_ascii=False), time.time())
+            )
+            total = self._conexion.execute("SELECT COUNT(*) FROM descripciones").fetchone()[0]
+            exceso = total - self.max_entradas
+            if exceso > 0:
+                self._conexion.execute(
+                    "DELETE FROM descripciones WHERE clave IN ("
+                    "SELECT clave FROM descripciones ORDER BY ultimo_uso ASC LIMIT ?)",
+                    (exceso,)
+                )
+            self._conexion.commit()
+
+    def estadisticas(self):
+        with self._lock:
+            entradas = self._conexion.execute("SELECT COUNT(*) FROM descripciones").fetchone()[0]
+        return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": entradas}
@@ -0,0 +1,161 @@
+"""CLI por lotes: describe todas las imágenes de un directorio sin pasar por Streamlit
+
+Uso:
+    python -m utils.cli ENTRADA SALIDA [--idioma es] [--categoria general] [--hilos 4]
+                        [--sin-exif] [--jsonl resultados.jsonl] [--metricas metricas.json]
+
+Recorre ENTRADA de forma recursiva, escribe en SALIDA una copia renombrada de cada
+imagen, en su mismo formato y con el texto en sus metadatos (EXIF/XMP o iTXt en
+PNG), conservando las subcarpetas, y emite una línea JSON por
+imagen a medida que terminan, con los tokens gastados; el total y su coste
+estimado salen por la salida de error al terminar. La API key se lee de secrets.toml o de la variable
+de entorno GEMINI_API_KEY (o se usa GEMINI_BACKEND=falso para probar sin red).
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.cache import huella_contenido
+from utils.gemini import (
+    BACKEND_DISPONIBLE, GEMINI_HILOS, PROMPTS_CATEGORIAS, costo_tokens, describir_imagen, obtener_limitador,
+    sumar_tokens
+)
+from utils.imagen import EXTENSION_FORMATO, con_descripcion, formato_de, limpiar_nombre
+from utils.ingesta import ImagenRechazada, revisar
+from utils.metricas import metricas
+
+EXTENSIONES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def recorrer_imagenes(raiz, excluir=None):
+    """Genera las rutas de imagen bajo `raiz` sin cargar el árbol completo en memoria.
+
+    `excluir` es un directorio que no se recorre: si la salida está dentro de la
+    entrada, las copias que se van escribiendo no se vuelven a describir.
+    """
+    excluir = os.path.realpath(excluir) if excluir else None
+    for carpeta, subcarpetas, archivos in os.walk(raiz):
+        subcarpetas[:] = sorted(s for s in subcarpetas if os.path.realpath(os.path.join(carpeta, s)) != excluir)
+        for nombre in sorted(archivos):
+            if os.path.splitext(nombre)[1].lower() in EXTENSIONES:
+                yield os.path.join(carpeta, nombre)
+
+
+def procesar_archivo(ruta, idioma, categoria, guardar_exif, limitador):
+    """Describe una imagen y prepara los bytes de su copia; se ejecuta en un hilo del pool"""
+    with open(ruta, "rb") as f:
+        datos = f.read()
+    try:
+        revisar(datos)
+    except ImagenRechazada as e:
+        return {"nombre": "error", "descripcion": f"Imagen rechazada: {e}"}, None
+    resultado = describir_imagen(datos, idioma, categoria, limitador=limitador,
+                                 huella=huella_contenido(datos))
+    if resultado["nombre"] == "error":
+        return resultado, None
+
+    return resultado, con_descripcion(datos, resultado["descripcion"] if guardar_exif else None)
+
+
+def destino_libre(directorio, nombre):
+    """Ruta dentro de `directorio` que no pisa un archivo existente (añade _N)"""
+    base, ext = os.path.splitext(nombre)
+    ruta = os.path.join(directorio, nombre)
+    n = 0
+    while os.path.exists(ruta):
+        n += 1
+        ruta = os.path.join(directorio, f"{base}_{n}{ext}")
+    return ruta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.cli",
+        description="Genera texto alternativo para todas las imágenes de un directorio."
+    )
+    parser.add_argument("entrada", help="directorio con las imágenes (se recorre recursivamente)")
+    parser.add_argument("salida", help="directorio donde escribir las copias renombradas")
+    parser.add_argument("--idioma", choices=["es", "en"], default="es")
+    parser.add_argument("--categoria", choices=sorted(PROMPTS_CATEGORIAS), default="general")
+    parser.add_argument("--hilos", type=int, default=GEMINI_HILOS,
+                        help="solicitudes simultáneas (por defecto GEMINI_HILOS)")
+    parser.add_argument("--sin-exif", action="store_true", help="solo renombrar, sin escribir metadatos")
+    parser.add_argument("--jsonl", help="archivo JSONL de resultados (por defecto, salida estándar)")
+    parser.add_argument("--metricas", help="archivo JSON donde dejar los tiempos por etapa al terminar")
+    args = parser.parse_args(argv)
+
+    if not BACKEND_DISPONIBLE:
+        print("Error: API key de Gemini no configurada (GEMINI_API_KEY)", file=sys.stderr)
+        return 2
+
+    if os.path.realpath(args.salida) == os.path.realpath(args.entrada):
+        print("Error: el directorio de salida no puede ser el de entrada", file=sys.stderr)
+        return 2
+
+    limitador = obtener_limitador()
+    hilos = max(1, args.hilos)
+    salida_jsonl = open(args.jsonl, "a", encoding="utf-8") if args.jsonl else sys.stdout
+    errores = 0
+    consumo = {}
+
+    def emitir(futuro, ruta):
+        nonlocal errores, consumo
+        registro = {"origen": ruta}
+        try:
+            resultado, datos = futuro.result()
+        except Exception as e:
+            resultado, datos = {"nombre": "error", "descripcion": f"Error al procesar: {e}"}, None
+
+        if datos is None:
+            errores += 1
+            registro["error"] = resultado["descripcion"]
+        else:
+            relativa = os.path.relpath(os.path.dirname(ruta), args.entrada)
+            directorio = os.path.normpath(os.path.join(args.salida, relativa))
+            os.makedirs(directorio, exist_ok=True)
+            extension = EXTENSION_FORMATO.get(formato_de(datos), "jpg")
+            destino = destino_libre(directorio, f"{limpiar_nombre(resultado['nombre'])}.{extension}")
+            with open(destino, "wb") as f:
+                f.write(datos)
+            registro.update(destino=destino, nombre=resultado["nombre"],
+                            descripcion=resultado["descripcion"],
+                            bytes_enviados=resultado.get("bytes_enviados", 0),
+                            tokens=resultado.get("tokens", {}))
+            consumo = sumar_tokens(consumo, resultado.get("tokens"))
+        salida_jsonl.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        salida_jsonl.flush()
+
+    # Como mucho 2×hilos imágenes en vuelo: la memoria no crece con el tamaño del árbol
+    en_vuelo = {}
+    try:
+        with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="cli") as pool:
+            for ruta in recorrer_imagenes(args.entrada, excluir=args.salida):
+                if len(en_vuelo) >= hilos * 2:
+                    hechos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    for futuro in hechos:
+                        emitir(futuro, en_vuelo.pop(futuro))
+                futuro = pool.submit(procesar_archivo, ruta, args.idioma, args.categoria,
+                                     not args.sin_exif, limitador)
+                en_vuelo[futuro] = ruta
+            while en_vuelo:
+                hechos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    emitir(futuro, en_vuelo.pop(futuro))
+    finally:
+        if salida_jsonl is not sys.stdout:
+            salida_jsonl.close()
+        if args.metricas:
+            with open(args.metricas, "w", encoding="utf-8") as f:
+                json.dump(metricas.instantanea(), f, ensure_ascii=False, indent=2)
+        if consumo:
+            print(f"Tokens: {consumo.get('entrada', 0)} de entrada, {consumo.get('salida', 0)} de salida "
+                  f"(~{costo_tokens(consumo):.4f} USD)", file=sys.stderr)
+
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,15 @@
+"""Módulo de configuración: lectura de secrets con respaldo en variables de entorno"""
+
+import os
+import streamlit as st
+
+
+def secreto(nombre, defecto=None):
+    """Valor de st.secrets o, si no hay secrets (p. ej. desde la CLI), de la variable de entorno"""
+    try:
+        if nombre in st.secrets:
+            return st.secrets[nombre]
+    except Exception:
+        # Sin secrets.toml st.secrets lanza al leerse; se usa el entorno
+        pass
+    return os.environ.get(nombre, defecto)
@@ -1,38 +1,256 @@
 """Módulo de contadores: lectura y actualización de estadísticas en JSONBin"""
 
+import atexit
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
 import streamlit as st
-import requests
 
-JSONBIN_BIN_ID = st.secrets.get("JSONBIN_BIN_ID", "")
-JSONBIN_API_KEY = st.secrets.get("JSONBIN_API_KEY", "")
+from utils.config import secreto
+
+log = logging.getLogger("garytext")
+
+JSONBIN_BIN_ID = secreto("JSONBIN_BIN_ID", "")
+JSONBIN_API_KEY = secreto("JSONBIN_API_KEY", "")
+# Base de la API; se puede apuntar a un servidor local de pruebas
+JSONBIN_URL = secreto("JSONBIN_URL", "https://api.jsonbin.io/v3")
+
+# "jsonbin" (por defecto) o "local" (solo SQLite, sin servicio remoto)
+CONTADORES_BACKEND = secreto("CONTADORES_BACKEND", "jsonbin")
+CONTADORES_RUTA = secreto("CONTADORES_RUTA", os.path.join(tempfile.gettempdir(), "garytext_contadores.sqlite3"))
+
+# Segundos que se sirven los contadores desde memoria antes de refrescarlos
+CONTADORES_TTL = int(secreto("CONTADORES_TTL", 60))
+# Cada cuántos segundos se envían al almacén remoto los incrementos acumulados
+CONTADORES_INTERVALO = int(secreto("CONTADORES_INTERVALO", 30))
+
+CERO = {"imagenes": 0, "visitas": 0}
+
+
+@st.cache_resource
+def obtener_sesion_http():
+    """Sesión HTTP compartida: reutiliza conexiones TLS con JSONBin entre reruns"""
+    # requests se importa al primer uso: los contadores se leen en segundo plano
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    sesion = requests.Session()
+    sesion.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=8))
+    return sesion
+
+
+class AlmacenContadores:
+    """Interfaz de almacén: leer() y incrementar(deltas), ambos devuelven el dict de contadores"""
+
+    def leer(self):
+        raise NotImplementedError
+
+    def incrementar(self, deltas):
+        raise NotImplementedError
+
+
+class AlmacenLocal(AlmacenContadores):
+    """Contadores en SQLite con incrementos atómicos (seguros entre hilos y procesos)"""
+
+    def __init__(self, ruta, tabla="contadores"):
+        self.tabla = tabla
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False, timeout=10)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            f"CREATE TABLE IF NOT EXISTS {tabla} (nombre TEXT PRIMARY KEY, valor INTEGER NOT NULL)"
+        )
+        self._conexion.commit()
+
+    def leer(self):
+        with self._lock:
+            filas = self._conexion.execute(f"SELECT nombre, valor FROM {self.tabla}").fetchall()
+        return {**CERO, **dict(filas)}
+
+    def incrementar(self, deltas):
+        with self._lock, self._conexion:
+            self._conexion.executemany(
+                f"INSERT INTO {self.tabla} (nombre, valor) VALUES (?, ?) "
+                "ON CONFLICT(nombre) DO UPDATE SET valor = valor + excluded.valor",
+                [(nombre, delta) for nombre, delta in deltas.items() if delta]
+            )
+        return self.leer()
+
+    def tomar_todo(self):
+        """Lee y pone a cero todos los contadores en una sola transacción"""
+        with self._lock, self._conexion:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            filas = self._conexion.execute(
+                f"SELECT nombre, valor FROM {self.tabla} WHERE valor != 0"
+            ).fetchall()
+            self._conexion.execute(f"UPDATE {self.tabla} SET valor = 0")
+        return dict(filas)
+
+
+class AlmacenJSONBin(AlmacenContadores):
+    """Contadores en un bin de JSONBin (lectura-modificación-escritura, sin atomicidad)"""
+
+    def __init__(self, bin_id, api_key, url_base=JSONBIN_URL, sesion=None):
+        self.url = f"{url_base.rstrip('/')}/b/{bin_id}"
+        self.api_key = api_key
+        self._sesion = sesion
+
+    @property
+    def sesion(self):
+        # Sin sesión propia se usa la compartida, creada en la primera petición
+        if self._sesion is None:
+            self._sesion = obtener_sesion_http()
+        return self._sesion
+
+    def leer(self):
+        response = self.sesion.get(f"{self.url}/latest", headers={"X-Master-Key": self.api_key}, timeout=5)
+        response.raise_for_status()
+        return response.json()["record"]
+
+    def incrementar(self, deltas):
+        datos = self.leer()
+        for nombre, delta in deltas.items():
+            datos[nombre] = datos.get(nombre, 0) + delta
+        headers = {"Content-Type": "application/json", "X-Master-Key": self.api_key}
+        response = self.sesion.put(self.url, json=datos, headers=headers, timeout=5)
+        response.raise_for_status()
+        return datos
+
+
+class AgregadorDiferido:
+    """Write-behind: acumula incrementos en un almacén local y los vuelca al remoto cada `intervalo` s.
+
+    Los incrementos pendientes viven en SQLite, así que no se pierden si el proceso
+    se reinicia antes del volcado y se suman bien aunque haya varias sesiones.
+    """
+
+    def __init__(self, remoto, pendientes, intervalo=CONTADORES_INTERVALO):
+        self.remoto = remoto
+        self.pendientes = pendientes
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._volcado = threading.Lock()
+        self._hilo = threading.Thread(target=self._bucle, name="contadores-volcado", daemon=True)
+        self._hilo.start()
+        atexit.register(self.vaciar)
+
+    def sumar(self, deltas):
+        self.pendientes.incrementar(deltas)
+
+    def vaciar(self):
+        """Envía los incrementos pendientes; si falla, los devuelve a la cola local"""
+        with self._volcado:
+            deltas = self.pendientes.tomar_todo()
+            if not deltas:
+                return None
+            try:
+                return self.remoto.incrementar(deltas)
+            except Exception as e:
+                log.warning(f"No se pudieron volcar los contadores: {e}")
+                self.pendientes.incrementar(deltas)
+                return None
+
+    def _bucle(self):
+        while not self._parar.wait(self.intervalo):
+            self.vaciar()
+
+    def detener(self):
+        self._parar.set()
+        self.vaciar()
+
+
+@st.cache_resource
+def obtener_almacen():
+    """Almacén de contadores configurado con CONTADORES_BACKEND"""
+    if CONTADORES_BACKEND == "local":
+        return AlmacenLocal(CONTADORES_RUTA)
+    return AlmacenJSONBin(JSONBIN_BIN_ID, JSONBIN_API_KEY, JSONBIN_URL)
+
+
+@st.cache_resource
+def obtener_agregador():
+    return AgregadorDiferido(obtener_almacen(), AlmacenLocal(CONTADORES_RUTA, tabla="pendientes"))
+
+
+def _total(almacen, pendientes):
+    """Valor remoto más lo que aún no se volcó"""
+    datos = {**CERO, **almacen.leer()}
+    for nombre, delta in pendientes.leer().items():
+        datos[nombre] = datos.get(nombre, 0) + delta
+    return datos
+
+
+class CacheContadores:
+    """Última lectura conocida de los contadores, refrescada en segundo plano al caducar"""
+
+    def __init__(self, ttl=CONTADORES_TTL):
+        self.ttl = ttl
+        self.valor = None
+        self.actualizado = 0.0
+        self._refrescando = False
+        self._lock = threading.Lock()
+
+    def leer(self, almacen, pendientes):
+        """Devuelve al instante el valor en caché (None antes de la primera lectura)"""
+        with self._lock:
+            caducado = time.monotonic() - self.actualizado > self.ttl
+            if caducado and not self._refrescando:
+                self._refrescando = True
+                threading.Thread(
+                    target=self._refrescar, args=(almacen, pendientes), name="contadores", daemon=True
+                ).start()
+            return self.valor
+
+    def _refrescar(self, almacen, pendientes):
+        try:
+            self.fijar(_total(almacen, pendientes))
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._refrescando = False
+
+    def fijar(self, datos):
+        with self._lock:
+            self.valor = dict(datos)
+            self.actualizado = time.monotonic()
+
+    def sumar(self, deltas):
+        """Refleja un incremento local sin esperar al próximo refresco"""
+        with self._lock:
+            if self.valor is not None:
+                for nombre, delta in deltas.items():
+                    self.valor[nombre] = self.valor.get(nombre, 0) + delta
+
+
+@st.cache_resource
+def obtener_cache_contadores():
+    return CacheContadores()
+
+
+def contadores_en_cache():
+    """Contadores para el footer sin bloquear la página; None hasta la primera lectura"""
+    return obtener_cache_contadores().leer(obtener_almacen(), obtener_agregador().pendientes)
 
 
 def obtener_contadores():
-    """Obtiene los contadores actuales desde JSONbin"""
+    """Obtiene los contadores actuales (remotos + pendientes de volcar)"""
     try:
-        url = f"https://api.jsonbin.io/v3/b/{JSONBIN_BIN_ID}/latest"
-        headers = {"X-Master-Key": JSONBIN_API_KEY}
-        response = requests.get(url, headers=headers, timeout=5)
-        if response.status_code == 200:
-            return response.json()["record"]
-        return {"imagenes": 0, "visitas": 0}
-    except:
-        return {"imagenes": 0, "visitas": 0}
+        return _total(obtener_almacen(), obtener_agregador().pendientes)
+    except Exception:
+        return dict(CERO)
 
 
 def actualizar_contadores(imagenes=0, visitas=0):
-    """Incrementa los contadores en JSONbin"""
+    """Encola los incrementos; el agregador los envía al almacén en segundo plano"""
+    deltas = {"imagenes": imagenes, "visitas": visitas}
     try:
-        datos = obtener_contadores()
-        datos["imagenes"] = datos.get("imagenes", 0) + imagenes
-        datos["visitas"] = datos.get("visitas", 0) + visitas
-
-        url = f"https://api.jsonbin.io/v3/b/{JSONBIN_BIN_ID}"
-        headers = {
-            "Content-Type": "application/json",
-            "X-Master-Key": JSONBIN_API_KEY
-        }
-        requests.put(url, json=datos, headers=headers, timeout=5)
-        return datos
-    except:
-        return {"imagenes": 0, "visitas": 0}
+        obtener_agregador().sumar(deltas)
+        obtener_cache_contadores().sumar(deltas)
+    except Exception as e:
+        log.warning(f"No se pudieron registrar los contadores: {e}")
+    return obtener_cache_contadores().valor or dict(CERO)
@@ -0,0 +1,51 @@
+"""Módulo de diario de lotes: progreso persistente para reanudar un lote interrumpido"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DIAS_RETENCION = 7
+
+
+def id_trabajo(huellas, variantes):
+    """Identifica un lote por su contenido (sin importar el orden de subida) y sus variantes"""
+    base = "|".join(sorted(set(huellas))) + "|" + ",".join(f"{i}/{c}" for i, c in variantes)
+    return hashlib.sha256(base.encode('utf-8')).hexdigest()
+
+
+class DiarioLotes:
+    """Registra en SQLite el resultado de cada imagen terminada, por lote y hash de contenido"""
+
+    def __init__(self, ruta, dias_retencion=DIAS_RETENCION):
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS entradas ("
+            "trabajo TEXT NOT NULL, huella TEXT NOT NULL, correcto INTEGER NOT NULL, "
+            "resultado TEXT NOT NULL, actualizado REAL NOT NULL, PRIMARY KEY (trabajo, huella))"
+        )
+        # Los lotes abandonados no se guardan para siempre
+        self._conexion.execute(
+            "DELETE FROM entradas WHERE actualizado < ?", (time.time() - dias_retencion * 86400,)
+        )
+        self._conexion.commit()
+
+    def registrar(self, trabajo, huella, resultado, correcto=True):
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO entradas (trabajo, huella, correcto, resultado, actualizado) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (trabajo, huella, int(correcto), json.dumps(resultado, ensure_ascii=False), time.time())
+            )
+            self._conexion.commit()
+
+    def completadas(self, trabajo):
+        """{huella: resultados por variante} de las imágenes del lote que terminaron sin error"""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT huella, resultado FROM entradas WHERE trabajo = ? AND correcto = 1", (trabajo,)
+            ).fetchall()
+        return {huella: json.loads(resultado) for huella, resultado in filas}
@@ -0,0 +1,32 @@
+"""Módulo de exportación: construcción del ZIP en un archivo temporal"""
+
+import tempfile
+import zipfile
+
+# Hasta este tamaño el ZIP vive en memoria; por encima pasa a disco
+ZIP_MEMORIA_MAX = 32 * 1024 * 1024
+
+
+def nombre_unico(nombre, nombres_usados):
+    """Evita nombres duplicados dentro del ZIP añadiendo un sufijo _N"""
+    if nombre in nombres_usados:
+        nombres_usados[nombre] += 1
+        base, ext = nombre.rsplit('.', 1)
+        return f"{base}_{nombres_usados[nombre]}.{ext}"
+    nombres_usados[nombre] = 0
+    return nombre
+
+
+def construir_zip(elementos, max_memoria=ZIP_MEMORIA_MAX):
+    """Escribe pares (nombre, bytes) uno a uno en un ZIP sin recomprimir.
+
+    Las imágenes ya van comprimidas, así que se guardan con ZIP_STORED. Devuelve un
+    SpooledTemporaryFile posicionado al inicio que pasa a disco si supera `max_memoria`.
+    """
+    archivo = tempfile.SpooledTemporaryFile(max_size=max_memoria)
+    nombres_usados = {}
+    with zipfile.ZipFile(archivo, 'w', zipfile.ZIP_STORED) as zf:
+        for nombre, datos in elementos:
+            zf.writestr(nombre_unico(nombre, nombres_usados), datos)
+    archivo.seek(0)
+    return archivo
@@ -1,23 +1,139 @@
 """Módulo de IA: configuración y generación de descripciones con Gemini"""
 
+import hashlib
 import logging
+import os
 import re
+import tempfile
+import threading
 import time
 import streamlit as st
-import google.generativeai as genai
+
+from utils.backends import BackendFalso, BackendGemini, BackendGrabacion
+from utils.config import secreto
+from utils.cache import CacheDescripciones, clave_cache
+from utils.imagen import BytesEnvio, preparar_para_envio
+from utils.limitador import LimitadorTasa
+from utils.metricas import metricas
+from utils.reintentos import CUOTA, CircuitoAbierto, Disyuntor, PoliticaReintentos
 
 log = logging.getLogger("garytext")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
-GEMINI_API_KEY = st.secrets.get("GEMINI_API_KEY", "")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+GEMINI_API_KEY = secreto("GEMINI_API_KEY", "")
+
+# Cuota de la API (solicitudes por minuto) y concurrencia máxima del lote
+GEMINI_RPM = int(secreto("GEMINI_RPM", 15))
+GEMINI_HILOS = int(secreto("GEMINI_HILOS", 4))
+# Imágenes empaquetadas en cada solicitud (1 = una imagen por llamada)
+GEMINI_POR_SOLICITUD = int(secreto("GEMINI_POR_SOLICITUD", 1))
+
+# Reintentos: intentos por imagen y plazo total en segundos (incluidas las esperas)
+GEMINI_INTENTOS = int(secreto("GEMINI_INTENTOS", 4))
+GEMINI_PLAZO = float(secreto("GEMINI_PLAZO", 90))
+# Disyuntor: fallos seguidos que cortan las llamadas y segundos hasta volver a probar
+GEMINI_DISYUNTOR_UMBRAL = int(secreto("GEMINI_DISYUNTOR_UMBRAL", 5))
+GEMINI_DISYUNTOR_ENFRIAMIENTO = float(secreto("GEMINI_DISYUNTOR_ENFRIAMIENTO", 30))
+POLITICA_REINTENTOS = PoliticaReintentos(intentos=GEMINI_INTENTOS, plazo=GEMINI_PLAZO)
+
+MODELO_GEMINI = 'gemini-2.5-flash-lite'
+
+# Backend de generación: "gemini" (API real) o "falso" (local, sin red, para pruebas de carga)
+GEMINI_BACKEND = secreto("GEMINI_BACKEND", "gemini")
+# Backend falso: mediana y dispersión de la latencia (s), tasas de 503 y 429, y semilla
+FALSO_LATENCIA = float(secreto("FALSO_LATENCIA", 1.0))
+FALSO_DISPERSION = float(secreto("FALSO_DISPERSION", 0.3))
+FALSO_TASA_ERROR = float(secreto("FALSO_TASA_ERROR", 0.0))
+FALSO_TASA_429 = float(secreto("FALSO_TASA_429", 0.0))
+FALSO_SEMILLA = secreto("FALSO_SEMILLA", None)
+# Grabación de respuestas en JSONL: "grabar" envuelve al backend elegido, "reproducir" lo sustituye
+GRABACION_RUTA = secreto("GRABACION_RUTA", "")
+GRABACION_MODO = secreto("GRABACION_MODO", "grabar")
+
+# Sin API key solo se puede trabajar con el backend falso o reproduciendo una grabación
+BACKEND_DISPONIBLE = bool(
+    GEMINI_API_KEY or GEMINI_BACKEND == "falso" or (GRABACION_RUTA and GRABACION_MODO == "reproducir")
+)
+_SIN_BACKEND = {"nombre": "error", "descripcion": "Error: API key de Gemini no configurada"}
+
+# Caché persistente de descripciones (ruta y número máximo de entradas)
+CACHE_RUTA = secreto("CACHE_RUTA", os.path.join(tempfile.gettempdir(), "garytext_cache.sqlite3"))
+CACHE_MAX_ENTRADAS = int(secreto("CACHE_MAX_ENTRADAS", 5000))
+
+# Preprocesado antes de subir: lado máximo en px y calidad JPEG
+ENVIO_LADO_MAX = int(secreto("ENVIO_LADO_MAX", 1024))
+ENVIO_CALIDAD = int(secreto("ENVIO_CALIDAD", 85))
+
+# Precio en USD por millón de tokens (tarifa de pago de MODELO_GEMINI), solo para estimar el coste
+GEMINI_PRECIO_ENTRADA = float(secreto("GEMINI_PRECIO_ENTRADA", 0.10))
+GEMINI_PRECIO_SALIDA = float(secreto("GEMINI_PRECIO_SALIDA", 0.40))
 
 
 @st.cache_resource
 def obtener_modelo_gemini():
-    """Cachea el modelo Gemini para reutilizarlo"""
-    return genai.GenerativeModel('gemini-2.5-flash-lite')
+    """Cachea el modelo Gemini para reutilizarlo.
+
+    El SDK se importa y configura aquí, en el primer uso, y no al importar el
+    módulo: es la importación más lenta de la app y no hace falta para pintar.
+    """
+    with metricas.cronometro("importar_sdk"):
+        import google.generativeai as genai
+
+        if GEMINI_API_KEY:
+            genai.configure(api_key=GEMINI_API_KEY)
+        return genai.GenerativeModel(MODELO_GEMINI)
+
+
+@st.cache_resource
+def obtener_backend():
+    """Backend configurado con GEMINI_BACKEND, envuelto en la grabación si hay GRABACION_RUTA"""
+    if GRABACION_RUTA and GRABACION_MODO == "reproducir":
+        return BackendGrabacion(GRABACION_RUTA, "reproducir")
+    if GEMINI_BACKEND == "falso":
+        backend = BackendFalso(FALSO_LATENCIA, FALSO_DISPERSION, FALSO_TASA_ERROR, FALSO_TASA_429,
+                               semilla=FALSO_SEMILLA)
+    else:
+        backend = BackendGemini(obtener_modelo_gemini())
+    if GRABACION_RUTA:
+        return BackendGrabacion(GRABACION_RUTA, GRABACION_MODO, backend)
+    return backend
+
+
+def _precalentar():
+    try:
+        obtener_backend()
+    except Exception as e:
+        log.warning(f"No se pudo precalentar el backend: {e}")
+
+
+@st.cache_resource
+def precalentar():
+    """Prepara el backend (SDK y modelo) en segundo plano, una vez por proceso.
+
+    Se llama después de pintar la página, para que la primera imagen no pague
+    la importación del SDK y el arranque no espere por ella.
+    """
+    hilo = threading.Thread(target=_precalentar, name="precalentar", daemon=True)
+    hilo.start()
+    return hilo
+
+
+@st.cache_resource
+def obtener_limitador():
+    """Limitador compartido por todas las sesiones: la cuota es por API key"""
+    return LimitadorTasa(rpm=GEMINI_RPM)
+
+
+@st.cache_resource
+def obtener_disyuntor():
+    """Disyuntor compartido: si la API está caída, ninguna sesión sigue insistiendo"""
+    return Disyuntor(GEMINI_DISYUNTOR_UMBRAL, GEMINI_DISYUNTOR_ENFRIAMIENTO)
+
+
+@st.cache_resource
+def obtener_cache():
+    """Caché de descripciones compartida por todas las sesiones"""
+    return CacheDescripciones(CACHE_RUTA, max_entradas=CACHE_MAX_ENTRADAS)
 
 
 _PREFIJOS_ES = re.compile(
@@ -150,54 +266,350 @@ Rules:
 }
 
 
-def describir_imagen(imagen, idioma="es", categoria="general", reintentos=2):
-    """Genera descripción de imagen usando Gemini con reintentos automáticos"""
-    if not GEMINI_API_KEY:
-        return "Error: API key de Gemini no configurada"
+def _obtener_prompt(categoria, idioma):
+    return PROMPTS_CATEGORIAS.get(categoria, PROMPTS_CATEGORIAS["general"])[idioma]
+
+
+def version_prompt(categoria, idioma):
+    """Versión corta del prompt: cambia al editar PROMPTS_CATEGORIAS e invalida la caché"""
+    prompt = _obtener_prompt(categoria, idioma)
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+
+
+def _parsear_respuesta(texto, idioma):
+    """Extrae NOMBRE/DESCRIPCION de un bloque de respuesta"""
+    inicio = time.perf_counter()
+    nombre = ""
+    descripcion = texto
+
+    for linea in texto.split('\n'):
+        linea = linea.strip()
+        if linea.upper().startswith('NOMBRE:') or linea.upper().startswith('NAME:'):
+            nombre = linea.split(':', 1)[1].strip()
+        elif linea.upper().startswith('DESCRIPCION:') or linea.upper().startswith('DESCRIPTION:'):
+            descripcion = linea.split(':', 1)[1].strip()
+
+    # Limpiar prefijos no deseados de la descripción
+    descripcion = _limpiar_descripcion(descripcion, idioma)
+
+    # Si no se pudo parsear, usar el texto completo
+    if not nombre:
+        nombre = descripcion[:50] if descripcion else texto[:50]
+    metricas.observar("parsear", time.perf_counter() - inicio)
+    return {"nombre": nombre, "descripcion": descripcion}
+
+
+def _buscar_en_cache(clave):
+    """Consulta la caché y anota el acierto o el fallo en las métricas"""
+    guardado = obtener_cache().obtener(clave)
+    metricas.contar("cache_aciertos" if guardado is not None else "cache_fallos")
+    return guardado
+
+
+def _preparar(imagen):
+    # Lo que ya preparó el trabajador se cronometró allí: no se cuenta dos veces
+    if isinstance(imagen, BytesEnvio):
+        return imagen
+    with metricas.cronometro("preprocesar"):
+        return preparar_para_envio(imagen, ENVIO_LADO_MAX, ENVIO_CALIDAD)
+
+
+def sumar_tokens(*usos):
+    """Suma campo a campo dicts de tokens (los que falten cuentan como 0)"""
+    total = {}
+    for uso in usos:
+        for campo, valor in (uso or {}).items():
+            total[campo] = total.get(campo, 0) + valor
+    return total
+
+
+def costo_tokens(uso):
+    """Coste estimado en USD de un dict de tokens según GEMINI_PRECIO_*"""
+    uso = uso or {}
+    return (uso.get("entrada", 0) * GEMINI_PRECIO_ENTRADA + uso.get("salida", 0) * GEMINI_PRECIO_SALIDA) / 1e6
+
+
+def _repartir_tokens(uso, categorias):
+    """Reparte el uso de una llamada entre los resultados que produjo y lo anota por categoría.
 
-    if imagen.mode != 'RGB':
-        imagen = imagen.convert('RGB')
+    `categorias` tiene una entrada por resultado; el resto de la división entera va
+    a los primeros, así que la suma de las partes es exactamente `uso`.
+    """
+    partes = [{} for _ in categorias]
+    for campo, valor in uso.items():
+        base, resto = divmod(valor, len(partes))
+        for k, parte in enumerate(partes):
+            parte[campo] = base + (k < resto)
+    for parte, categoria in zip(partes, categorias):
+        metricas.contar_tokens(categoria, parte)
+    return partes
 
-    model = obtener_modelo_gemini()
 
-    prompt = PROMPTS_CATEGORIAS.get(categoria, PROMPTS_CATEGORIAS["general"])[idioma]
+def _solicitar(partes, reintentos=None, limitador=None):
+    """Envía la solicitud según POLITICA_REINTENTOS; devuelve la Respuesta o lanza el último error"""
+    backend = obtener_backend()
 
-    for intento in range(reintentos):
+    def enviar(restante):
+        log.info(f"Enviando request a Gemini (backend {backend.nombre})")
+        inicio = time.time()
         try:
-            log.info(f"Enviando request a Gemini (intento {intento + 1}/{reintentos})")
-            inicio = time.time()
-            response = model.generate_content([prompt, imagen])
+            respuesta = backend.generar(partes, restante)
+        finally:
             duracion = time.time() - inicio
-            texto = response.text.strip()
-            log.info(f"Respuesta recibida en {duracion:.1f}s ({len(texto)} chars)")
-
-            # Parsear respuesta para extraer nombre y descripción
-            nombre = ""
-            descripcion = texto
-
-            for linea in texto.split('\n'):
-                linea = linea.strip()
-                if linea.upper().startswith('NOMBRE:') or linea.upper().startswith('NAME:'):
-                    nombre = linea.split(':', 1)[1].strip()
-                elif linea.upper().startswith('DESCRIPCION:') or linea.upper().startswith('DESCRIPTION:'):
-                    descripcion = linea.split(':', 1)[1].strip()
-
-            # Limpiar prefijos no deseados de la descripción
-            descripcion = _limpiar_descripcion(descripcion, idioma)
-
-            # Si no se pudo parsear, usar el texto completo
-            if not nombre:
-                nombre = descripcion[:50] if descripcion else texto[:50]
-
-            log.info(f"Imagen procesada OK: '{nombre}'")
-            return {"nombre": nombre, "descripcion": descripcion}
-        except Exception as e:
-            log.warning(f"Error en intento {intento + 1}/{reintentos}: {str(e)}")
-            if "429" in str(e) and intento < reintentos - 1:
-                log.info("Esperando 4s antes de reintentar...")
-                time.sleep(4)
-                continue
-            log.error(f"Error definitivo: {str(e)}")
-            return {"nombre": "error", "descripcion": f"Error al procesar: {str(e)}"}
-
-    return {"nombre": "error", "descripcion": "Error: No se pudo procesar después de varios intentos"}
+            metricas.observar("espera_api", duracion)
+        log.info(f"Respuesta recibida en {duracion:.1f}s ({len(respuesta.texto)} chars, "
+                 f"{respuesta.uso.get('entrada', '?')} tokens de entrada)")
+        return respuesta
+
+    def registrar(intento, intentos, tipo, error):
+        log.warning(f"Error en intento {intento + 1}/{intentos} ({tipo}): {str(error)}")
+        metricas.contar(f"errores_{tipo}")
+        if tipo == CUOTA:
+            metricas.contar("respuestas_429")
+            log.info("Cuota agotada: se pausa el limitador compartido")
+
+    metricas.contar("solicitudes")
+    try:
+        return POLITICA_REINTENTOS.ejecutar(enviar, limitador, obtener_disyuntor(), reintentos, registrar)
+    except CircuitoAbierto:
+        metricas.contar("circuito_abierto")
+        raise
+
+
+def describir_imagen(imagen, idioma="es", categoria="general", reintentos=None, limitador=None,
+                     huella=None):
+    """Describe una imagen (PIL o bytes originales); con `huella` consulta antes la caché"""
+    if not BACKEND_DISPONIBLE:
+        return dict(_SIN_BACKEND)
+
+    clave = None
+    if huella:
+        clave = clave_cache(huella, idioma, categoria, MODELO_GEMINI, version_prompt(categoria, idioma))
+        guardado = _buscar_en_cache(clave)
+        if guardado is not None:
+            log.info(f"Descripción desde caché: '{guardado['nombre']}'")
+            return {**guardado, "bytes_enviados": 0, "tokens": {}}
+    return _describir(imagen, idioma, categoria, reintentos, limitador, clave)
+
+
+def _describir(imagen, idioma, categoria, reintentos, limitador, clave):
+    """Pide una sola imagen sin consultar la caché; la respuesta correcta se guarda en `clave`"""
+    datos = _preparar(imagen)
+    log.info(f"Imagen preparada para envío: {len(datos) / 1024:.0f} KB")
+
+    prompt = _obtener_prompt(categoria, idioma)
+
+    try:
+        respuesta = _solicitar([prompt, {"mime_type": "image/jpeg", "data": datos}], reintentos, limitador)
+    except Exception as e:
+        log.error(f"Error definitivo: {str(e)}")
+        return {"nombre": "error", "descripcion": f"Error al procesar: {str(e)}"}
+
+    resultado = _parsear_respuesta(respuesta.texto, idioma)
+    log.info(f"Imagen procesada OK: '{resultado['nombre']}'")
+    if clave:
+        obtener_cache().guardar(clave, resultado)
+    [tokens] = _repartir_tokens(respuesta.uso, [categoria])
+    return {**resultado, "bytes_enviados": len(datos), "tokens": tokens}
+
+
+_MARCA_VARIANTE = re.compile(r'^\s*\[VARIANTE\s+(\d+)\]\s*$', re.IGNORECASE | re.MULTILINE)
+_MARCA_IMAGEN = re.compile(r'^\s*\[IMAGEN\s+(\d+)\]\s*$', re.IGNORECASE | re.MULTILINE)
+
+
+def construir_prompt_combinado(variantes):
+    """Un solo prompt que pide un bloque NOMBRE/DESCRIPCION por cada (idioma, categoría)"""
+    partes = [
+        f"Vas a analizar la misma imagen {len(variantes)} veces, una por cada variante. "
+        "Cada variante tiene sus propias instrucciones e idioma; síguelas solo dentro de su bloque.\n"
+        "Responde con un bloque por variante, en orden, empezando cada bloque con una línea "
+        "que contenga solo su marca, por ejemplo [VARIANTE 1], seguida de sus líneas en el formato pedido."
+    ]
+    for n, (idioma, categoria) in enumerate(variantes, 1):
+        partes.append(f"[VARIANTE {n}]\n{_obtener_prompt(categoria, idioma)}")
+    return "\n\n".join(partes)
+
+
+def _separar_bloques(texto, n, patron):
+    """Divide una respuesta en `n` bloques según sus marcas [... k]; None para los que falten"""
+    bloques = [None] * n
+    marcas = list(patron.finditer(texto))
+    for i, marca in enumerate(marcas):
+        numero = int(marca.group(1))
+        fin = marcas[i + 1].start() if i + 1 < len(marcas) else len(texto)
+        contenido = texto[marca.end():fin].strip()
+        if 1 <= numero <= n and contenido:
+            bloques[numero - 1] = contenido
+    return bloques
+
+
+def separar_variantes(texto, n):
+    """Divide la respuesta combinada en bloques [VARIANTE k]"""
+    return _separar_bloques(texto, n, _MARCA_VARIANTE)
+
+
+def describir_imagen_variantes(imagen, variantes, reintentos=None, limitador=None, huella=None):
+    """Describe la imagen para varias combinaciones (idioma, categoría) en una sola llamada.
+
+    Devuelve una lista de resultados alineada con `variantes`. Las variantes que ya
+    están en caché no se piden, y las que falten en la respuesta combinada se
+    piden por separado. Los tokens de la llamada combinada se reparten a partes
+    iguales entre las variantes pedidas.
+    """
+    variantes = list(variantes)
+    if len(variantes) == 1:
+        idioma, categoria = variantes[0]
+        return [describir_imagen(imagen, idioma, categoria, reintentos, limitador, huella)]
+    if not BACKEND_DISPONIBLE:
+        return [dict(_SIN_BACKEND) for _ in variantes]
+
+    resultados = [None] * len(variantes)
+    claves = [None] * len(variantes)
+    if huella:
+        for i, (idioma, categoria) in enumerate(variantes):
+            claves[i] = clave_cache(huella, idioma, categoria, MODELO_GEMINI, version_prompt(categoria, idioma))
+            guardado = _buscar_en_cache(claves[i])
+            if guardado is not None:
+                resultados[i] = {**guardado, "bytes_enviados": 0, "tokens": {}}
+    faltan = [i for i, r in enumerate(resultados) if r is None]
+    if not faltan:
+        return resultados
+    if len(faltan) == 1:
+        i = faltan[0]
+        resultados[i] = _describir(imagen, *variantes[i], reintentos, limitador, claves[i])
+        return resultados
+
+    datos = _preparar(imagen)
+    pedidas = [variantes[i] for i in faltan]
+    log.info(f"Imagen preparada para envío: {len(datos) / 1024:.0f} KB ({len(pedidas)} variantes)")
+    try:
+        respuesta = _solicitar(
+            [construir_prompt_combinado(pedidas), {"mime_type": "image/jpeg", "data": datos}],
+            reintentos, limitador
+        )
+        bloques = separar_variantes(respuesta.texto, len(pedidas))
+    except Exception as e:
+        log.error(f"Error definitivo: {str(e)}")
+        error = {"nombre": "error", "descripcion": f"Error al procesar: {str(e)}"}
+        for i in faltan:
+            resultados[i] = dict(error)
+        return resultados
+
+    # Los bytes de la imagen se cuentan una vez, en la primera variante pedida
+    enviados = len(datos)
+    repartidos = _repartir_tokens(respuesta.uso, [categoria for _, categoria in pedidas])
+    for i, bloque, tokens in zip(faltan, bloques, repartidos):
+        idioma, categoria = variantes[i]
+        if bloque is None:
+            log.warning(f"Falta la variante {idioma}/{categoria} en la respuesta; se pide por separado")
+            reenvio = _describir(imagen, idioma, categoria, reintentos, limitador, claves[i])
+            resultados[i] = {**reenvio, "tokens": sumar_tokens(tokens, reenvio.get("tokens"))}
+            continue
+        resultado = _parsear_respuesta(bloque, idioma)
+        if claves[i]:
+            obtener_cache().guardar(claves[i], resultado)
+        resultados[i] = {**resultado, "bytes_enviados": enviados, "tokens": tokens}
+        enviados = 0
+    log.info(f"Variantes procesadas OK: {[r['nombre'] for r in resultados]}")
+    return resultados
+
+
+def construir_prompt_paquete(n, idioma="es", categoria="general"):
+    """Prompt para `n` imágenes marcadas con [IMAGEN k] en una sola solicitud"""
+    return (
+        f"Vas a recibir {n} imágenes distintas, cada una precedida por su marca [IMAGEN k]. "
+        "Analiza cada imagen por separado siguiendo estas instrucciones:\n\n"
+        f"{_obtener_prompt(categoria, idioma)}\n\n"
+        "Responde con un bloque por imagen, en orden, empezando cada bloque con una línea "
+        "que contenga solo su marca, por ejemplo [IMAGEN 1], seguida de sus líneas en el formato pedido."
+    )
+
+
+def _bloque_valido(bloque):
+    """Un bloque sirve si trae tanto el nombre como la descripción"""
+    if not bloque:
+        return False
+    claves = {linea.strip().split(':', 1)[0].upper() for linea in bloque.split('\n') if ':' in linea}
+    return bool(claves & {'NOMBRE', 'NAME'}) and bool(claves & {'DESCRIPCION', 'DESCRIPTION'})
+
+
+def describir_imagenes_paquete(imagenes, idioma="es", categoria="general", reintentos=None,
+                               limitador=None, huellas=None):
+    """Describe varias imágenes con una sola llamada a generate_content.
+
+    Las imágenes van marcadas con [IMAGEN k] y la respuesta se separa por esas
+    marcas. Las que ya están en caché no se envían, y si el bloque de alguna
+    falta o no trae NOMBRE/DESCRIPCION se reenvía solo esa imagen. Devuelve una
+    lista de resultados alineada con `imagenes`; los tokens del paquete se
+    reparten a partes iguales entre las imágenes enviadas.
+    """
+    imagenes = list(imagenes)
+    huellas = list(huellas) if huellas else [None] * len(imagenes)
+    if not BACKEND_DISPONIBLE:
+        return [dict(_SIN_BACKEND) for _ in imagenes]
+
+    resultados = [None] * len(imagenes)
+    claves = [None] * len(imagenes)
+    for i, huella in enumerate(huellas):
+        if huella:
+            claves[i] = clave_cache(huella, idioma, categoria, MODELO_GEMINI, version_prompt(categoria, idioma))
+            guardado = _buscar_en_cache(claves[i])
+            if guardado is not None:
+                resultados[i] = {**guardado, "bytes_enviados": 0, "tokens": {}}
+    faltan = [i for i, r in enumerate(resultados) if r is None]
+    if len(faltan) <= 1:
+        for i in faltan:
+            resultados[i] = _describir(imagenes[i], idioma, categoria, reintentos, limitador, claves[i])
+        return resultados
+
+    datos = {i: _preparar(imagenes[i]) for i in faltan}
+    partes = [construir_prompt_paquete(len(faltan), idioma, categoria)]
+    for k, i in enumerate(faltan, 1):
+        partes += [f"[IMAGEN {k}]", {"mime_type": "image/jpeg", "data": datos[i]}]
+    log.info(f"Paquete de {len(faltan)} imágenes preparado: {sum(map(len, datos.values())) / 1024:.0f} KB")
+
+    try:
+        respuesta = _solicitar(partes, reintentos, limitador)
+        bloques = _separar_bloques(respuesta.texto, len(faltan), _MARCA_IMAGEN)
+    except Exception as e:
+        log.error(f"Error definitivo: {str(e)}")
+        for i in faltan:
+            resultados[i] = {"nombre": "error", "descripcion": f"Error al procesar: {str(e)}"}
+        return resultados
+
+    repartidos = _repartir_tokens(respuesta.uso, [categoria] * len(faltan))
+    for i, bloque, tokens in zip(faltan, bloques, repartidos):
+        if not _bloque_valido(bloque):
+            log.warning("Bloque ausente o mal formado en el paquete; se reenvía esa imagen sola")
+            # Se reenvían los bytes ya preparados: no hace falta volver a reducir
+            reenvio = _describir(datos[i], idioma, categoria, reintentos, limitador, claves[i])
+            resultados[i] = {**reenvio, "tokens": sumar_tokens(tokens, reenvio.get("tokens"))}
+            continue
+        resultado = _parsear_respuesta(bloque, idioma)
+        if claves[i]:
+            obtener_cache().guardar(claves[i], resultado)
+        resultados[i] = {**resultado, "bytes_enviados": len(datos[i]), "tokens": tokens}
+    log.info(f"Paquete procesado OK: {[r['nombre'] for r in resultados]}")
+    return resultados
+
+
+def describir_grupo(imagenes, variantes, limitador=None, huellas=None):
+    """Describe un grupo de imágenes con el menor número de llamadas.
+
+    Con varias variantes cada imagen va en modo combinado; con una sola, el grupo
+    viaja en un paquete. Sin `limitador` se usa el compartido entre sesiones.
+    Devuelve, por imagen, una lista alineada con `variantes`.
+    """
+    imagenes = list(imagenes)
+    variantes = list(variantes)
+    limitador = limitador or obtener_limitador()
+    huellas = list(huellas) if huellas else [None] * len(imagenes)
+    if len(variantes) > 1:
+        return [describir_imagen_variantes(imagen, variantes, limitador=limitador, huella=huella)
+                for imagen, huella in zip(imagenes, huellas)]
+    idioma, categoria = variantes[0]
+    if len(imagenes) > 1:
+        return [[r] for r in describir_imagenes_paquete(imagenes, idioma, categoria,
+                                                        limitador=limitador, huellas=huellas)]
+    return [[describir_imagen(imagen, idioma, categoria, limitador=limitador, huella=huella)]
+            for imagen, huella in zip(imagenes, huellas)]
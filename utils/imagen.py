@@ -1,8 +1,16 @@
-"""Módulo de procesamiento de imágenes: EXIF, conversión y limpieza de nombres"""
+"""Módulo de procesamiento de imágenes: metadatos (EXIF, XMP, iTXt), conversión y limpieza de nombres"""
 
 import re
 import io
+import struct
+import zlib
+from xml.sax.saxutils import escape
+
 import piexif
+from PIL import Image
+
+from utils.ingesta import decodificar_acotado
+from utils.metricas import metricas
 
 
 def limpiar_nombre(texto):
@@ -22,7 +30,216 @@ def agregar_exif(imagen, texto_alt):
         return None
 
 
-def imagen_a_bytes(imagen, exif_bytes=None):
+def es_jpeg(datos):
+    return datos is not None and datos[:2] == b"\xff\xd8"
+
+
+def insertar_exif_jpeg(datos_jpeg, exif_bytes):
+    """Inserta el segmento EXIF en los bytes JPEG originales, sin decodificar ni recodificar"""
+    buffer = io.BytesIO()
+    piexif.insert(exif_bytes, bytes(datos_jpeg), buffer)
+    buffer.seek(0)
+    return buffer
+
+
+EXTENSION_FORMATO = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+MIME_FORMATO = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+_FIRMA_PNG = b"\x89PNG\r\n\x1a\n"
+_CABECERA_XMP_JPEG = b"http://ns.adobe.com/xap/1.0/\x00"
+_CLAVES_PNG = (b"Description", b"XML:com.adobe.xmp")
+
+
+def formato_de(datos):
+    """JPEG, PNG o WEBP según la firma de los bytes; None si no es ninguno"""
+    if es_jpeg(datos):
+        return "JPEG"
+    if datos[:8] == _FIRMA_PNG:
+        return "PNG"
+    if datos[:4] == b"RIFF" and datos[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def paquete_xmp(texto_alt):
+    """XMP con el texto en dc:description y en el campo de texto alternativo de IPTC"""
+    texto = escape(texto_alt)
+    alternativa = f'<rdf:Alt><rdf:li xml:lang="x-default">{texto}</rdf:li></rdf:Alt>'
+    return (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/" '
+        'xmlns:Iptc4xmpCore="http://iptc.org/std/Iptc4xmpCore/1.0/xmlns/">'
+        f'<dc:description>{alternativa}</dc:description>'
+        f'<Iptc4xmpCore:AltTextAccessibility>{alternativa}</Iptc4xmpCore:AltTextAccessibility>'
+        '</rdf:Description></rdf:RDF></x:xmpmeta>'
+        '<?xpacket end="w"?>'
+    ).encode('utf-8')
+
+
+def insertar_xmp_jpeg(datos_jpeg, xmp):
+    """Sustituye o añade el segmento APP1 de XMP tras los segmentos APPn iniciales"""
+    vista = memoryview(datos_jpeg)
+    segmentos = []
+    pos = 2
+    while pos + 4 <= len(datos_jpeg) and datos_jpeg[pos] == 0xFF and 0xE0 <= datos_jpeg[pos + 1] <= 0xEF:
+        largo = struct.unpack(">H", datos_jpeg[pos + 2:pos + 4])[0]
+        segmento = vista[pos:pos + 2 + largo]
+        if not (datos_jpeg[pos + 1] == 0xE1 and segmento[4:4 + len(_CABECERA_XMP_JPEG)] == _CABECERA_XMP_JPEG):
+            segmentos.append(segmento)
+        pos += 2 + largo
+    cuerpo = _CABECERA_XMP_JPEG + xmp
+    nuevo = b"\xff\xe1" + struct.pack(">H", len(cuerpo) + 2) + cuerpo
+    # Se une una sola vez desde vistas: los bytes de la imagen se copian solo al final
+    return b"".join([vista[:2], *segmentos, nuevo, vista[pos:]])
+
+
+# Segmentos que hacen falta para decodificar bien: JFIF, perfil ICC y la transformación de color de Adobe
+_SEGMENTOS_NECESARIOS = ((0xE0, b"JFIF\x00"), (0xE2, b"ICC_PROFILE\x00"), (0xEE, b"Adobe"))
+
+
+def sin_metadatos_jpeg(datos_jpeg):
+    """Quita EXIF (con GPS y datos de la cámara), XMP, IPTC y comentarios sin tocar la imagen.
+
+    Se conservan solo los APPn de _SEGMENTOS_NECESARIOS; desde SOS todo se copia tal cual.
+    """
+    vista = memoryview(datos_jpeg)
+    partes = [vista[:2]]
+    pos = 2
+    while pos + 4 <= len(datos_jpeg) and datos_jpeg[pos] == 0xFF:
+        marcador = datos_jpeg[pos + 1]
+        if marcador == 0xFF:
+            # Byte de relleno antes de un marcador
+            pos += 1
+            continue
+        if marcador == 0xDA:
+            break
+        largo = struct.unpack(">H", datos_jpeg[pos + 2:pos + 4])[0]
+        segmento = vista[pos:pos + 2 + largo]
+        metadatos = 0xE0 <= marcador <= 0xEF or marcador == 0xFE
+        if not metadatos or any(marcador == m and segmento[4:4 + len(c)] == c for m, c in _SEGMENTOS_NECESARIOS):
+            partes.append(segmento)
+        pos += 2 + largo
+    partes.append(vista[pos:])
+    return b"".join(partes)
+
+
+def _chunk_png(tipo, datos):
+    return struct.pack(">I", len(datos)) + tipo + datos + struct.pack(">I", zlib.crc32(tipo + datos))
+
+
+def _itxt(clave, texto):
+    # Clave, sin comprimir, sin idioma ni clave traducida, texto UTF-8
+    return _chunk_png(b"iTXt", clave + b"\x00\x00\x00\x00\x00" + texto)
+
+
+def insertar_texto_png(datos_png, texto_alt, xmp):
+    """Añade iTXt Description y XMP justo después de IHDR; los chunks de imagen no se tocan"""
+    vista = memoryview(datos_png)
+    partes = [vista[:8]]
+    pos = 8
+    while pos + 8 <= len(datos_png):
+        largo = struct.unpack(">I", datos_png[pos:pos + 4])[0]
+        tipo = datos_png[pos + 4:pos + 8]
+        fin = pos + 12 + largo
+        chunk = vista[pos:fin]
+        # Se descartan los textos previos con las mismas claves para no duplicarlos
+        if not (tipo in (b"iTXt", b"tEXt", b"zTXt") and bytes(chunk[8:88]).split(b"\x00", 1)[0] in _CLAVES_PNG):
+            partes.append(chunk)
+        if tipo == b"IHDR":
+            partes += [_itxt(b"Description", texto_alt.encode('utf-8')), _itxt(b"XML:com.adobe.xmp", xmp)]
+        pos = fin
+    return b"".join(partes)
+
+
+def _chunk_riff(tipo, datos):
+    return [tipo, struct.pack("<I", len(datos)), datos, b"\x00" if len(datos) % 2 else b""]
+
+
+def _lienzo_webp(tipo, datos):
+    """(ancho, alto, alfa) leídos de la cabecera del flujo VP8 o VP8L de un WebP simple"""
+    if tipo == b"VP8L":
+        bits = struct.unpack("<I", datos[1:5])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, bool(bits >> 28 & 1)
+    if tipo == b"VP8 ":
+        ancho, alto = struct.unpack("<HH", datos[6:10])
+        return ancho & 0x3FFF, alto & 0x3FFF, False
+    raise ValueError("WebP sin flujo VP8/VP8L")
+
+
+def insertar_metadatos_webp(datos_webp, exif_bytes, xmp):
+    """Añade los chunks EXIF y XMP al contenedor RIFF, con VP8X si no lo tenía.
+
+    El flujo VP8/VP8L queda intacto; solo se reescriben las cabeceras del contenedor.
+    """
+    vista = memoryview(datos_webp)
+    chunks = []
+    pos = 12
+    while pos + 8 <= len(datos_webp):
+        tipo = datos_webp[pos:pos + 4]
+        largo = struct.unpack("<I", datos_webp[pos + 4:pos + 8])[0]
+        if tipo not in (b"EXIF", b"XMP "):
+            chunks.append((tipo, vista[pos + 8:pos + 8 + largo]))
+        pos += 8 + largo + (largo % 2)
+
+    if chunks and chunks[0][0] == b"VP8X":
+        vp8x = bytearray(chunks.pop(0)[1])
+    else:
+        ancho, alto, alfa = _lienzo_webp(*chunks[0])
+        vp8x = bytearray(struct.pack("<I", 0x10 if alfa else 0)
+                         + (ancho - 1).to_bytes(3, "little") + (alto - 1).to_bytes(3, "little"))
+    banderas = 0x04 | (0x08 if exif_bytes else 0)
+    vp8x[0] |= banderas
+
+    partes = _chunk_riff(b"VP8X", bytes(vp8x))
+    for tipo, datos in chunks:
+        partes += _chunk_riff(tipo, datos)
+    if exif_bytes:
+        # piexif.dump antepone la cabecera "Exif\0\0" de JPEG, que WebP no lleva
+        partes += _chunk_riff(b"EXIF", exif_bytes[6:] if exif_bytes.startswith(b"Exif\x00\x00") else exif_bytes)
+    partes += _chunk_riff(b"XMP ", xmp)
+    largo = sum(len(p) for p in partes)
+    return b"".join([b"RIFF", struct.pack("<I", largo + 4), b"WEBP", *partes])
+
+
+def con_descripcion(original, texto_alt=None):
+    """Bytes de descarga en el formato subido, con el texto alternativo en sus metadatos.
+
+    JPEG lleva EXIF y XMP, PNG un iTXt Description y XMP, y WebP los chunks EXIF
+    y XMP. En ningún caso se recodifican los píxeles; sin texto se devuelven los
+    bytes originales. Las etapas `exif` (crear los bloques de metadatos) y
+    `codificar` (insertarlos en el archivo) se cronometran por separado.
+    """
+    original = bytes(original)
+    if not texto_alt:
+        return original
+    formato = formato_de(original)
+    if formato not in EXTENSION_FORMATO:
+        raise ValueError("Formato de imagen no admitido")
+    with metricas.cronometro("exif"):
+        # PNG guarda el texto en un iTXt propio en lugar de EXIF
+        exif = agregar_exif(None, texto_alt) if formato != "PNG" else None
+        xmp = paquete_xmp(texto_alt)
+    with metricas.cronometro("codificar"):
+        if formato == "JPEG":
+            datos = insertar_exif_jpeg(original, exif).getvalue() if exif else original
+            return insertar_xmp_jpeg(datos, xmp)
+        if formato == "PNG":
+            return insertar_texto_png(original, texto_alt, xmp)
+        return insertar_metadatos_webp(original, exif, xmp)
+
+
+def imagen_a_bytes(imagen, exif_bytes=None, original=None):
+    """Bytes JPEG con EXIF, recodificando a calidad 95 lo que no sea JPEG.
+
+    Las descargas usan con_descripcion, que conserva el formato; esta conversión
+    queda para quien necesite un JPEG (y como referencia en el benchmark).
+    """
+    if es_jpeg(original):
+        if exif_bytes:
+            return insertar_exif_jpeg(original, exif_bytes)
+        return io.BytesIO(original)
     buffer = io.BytesIO()
     if exif_bytes:
         imagen.save(buffer, format="JPEG", exif=exif_bytes, quality=95)
@@ -30,3 +247,40 @@ def imagen_a_bytes(imagen, exif_bytes=None):
         imagen.save(buffer, format="JPEG", quality=95)
     buffer.seek(0)
     return buffer
+
+
+class BytesEnvio(bytes):
+    """JPEG que ya salió de preparar_para_envio: no se vuelve a preparar (ni a cronometrar)"""
+
+
+def preparar_para_envio(origen, lado_max=1024, calidad=85):
+    """Reduce la imagen a `lado_max` px por lado y la recodifica como JPEG compacto.
+
+    `origen` puede ser los bytes del archivo subido o una PIL.Image ya decodificada.
+    Con bytes JPEG se usa Image.draft para que la decodificación ya sea a escala
+    reducida, y si la imagen cabe en `lado_max` se envían sus mismos datos de
+    imagen, sin los metadatos (EXIF con GPS, XMP, IPTC) que no necesita Gemini.
+    Devuelve BytesEnvio, que esta función deja pasar sin tocarlos.
+    """
+    if isinstance(origen, BytesEnvio):
+        return origen
+    if isinstance(origen, Image.Image):
+        imagen = origen
+    else:
+        imagen = Image.open(io.BytesIO(origen))
+        if imagen.format == "JPEG" and max(imagen.size) <= lado_max:
+            return BytesEnvio(sin_metadatos_jpeg(origen))
+        # Los píxeles completos de PNG/WebP no sobreviven a la decodificación
+        imagen = decodificar_acotado(origen, lado_max)
+
+    if imagen.mode != 'RGB':
+        imagen = imagen.convert('RGB')
+    ancho, alto = imagen.size
+    escala = lado_max / max(ancho, alto)
+    if escala < 1:
+        nuevo = (max(1, round(ancho * escala)), max(1, round(alto * escala)))
+        imagen = imagen.resize(nuevo, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    buffer = io.BytesIO()
+    imagen.save(buffer, format="JPEG", quality=calidad)
+    return BytesEnvio(buffer.getvalue())
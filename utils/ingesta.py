@@ -0,0 +1,94 @@
+"""Módulo de ingesta: revisa cada archivo subido antes de decodificarlo
+
+Solo se lee la cabecera (formato y dimensiones) para aplicar los presupuestos de
+bytes y de píxeles. Los JPEG grandes se decodifican a escala reducida con
+draft(); PNG y WebP no lo permiten, así que su presupuesto de píxeles es menor y
+las decodificaciones completas grandes del proceso se hacen por turnos, para que
+varias sesiones a la vez no sumen sus picos de memoria.
+"""
+
+import io
+import threading
+import warnings
+from contextlib import contextmanager
+
+from PIL import Image, UnidentifiedImageError
+
+from utils.config import secreto
+
+INGESTA_MAX_MB = float(secreto("INGESTA_MAX_MB", 50))
+# PNG/WebP se decodifican completos: 40 MP son ~160 MB en RGBA
+INGESTA_MAX_MEGAPIXELES = float(secreto("INGESTA_MAX_MEGAPIXELES", 40))
+# Los JPEG se decodifican con draft() a 1/8 de escala como mucho
+INGESTA_MAX_MEGAPIXELES_JPEG = float(secreto("INGESTA_MAX_MEGAPIXELES_JPEG", 200))
+# Decodificaciones completas por encima de INGESTA_MEGAPIXELES_LIBRES que pueden ir a la vez
+INGESTA_DECODIFICACIONES = int(secreto("INGESTA_DECODIFICACIONES", 1))
+INGESTA_MEGAPIXELES_LIBRES = float(secreto("INGESTA_MEGAPIXELES_LIBRES", 12))
+
+FORMATOS = {"JPEG": "JPG", "PNG": "PNG", "WEBP": "WEBP"}
+
+# Cualquier Image.open del proceso que se salte la revisión falla igualmente con una bomba
+Image.MAX_IMAGE_PIXELS = int(max(INGESTA_MAX_MEGAPIXELES, INGESTA_MAX_MEGAPIXELES_JPEG) * 1e6)
+
+_turnos = threading.BoundedSemaphore(max(1, INGESTA_DECODIFICACIONES))
+
+
+class ImagenRechazada(ValueError):
+    """El archivo no cumple los presupuestos de ingesta; el mensaje explica el motivo al usuario"""
+
+
+def revisar(datos):
+    """Comprueba bytes, formato y píxeles leyendo solo la cabecera; devuelve (formato, ancho, alto)"""
+    megabytes = len(datos) / 2**20
+    if megabytes > INGESTA_MAX_MB:
+        raise ImagenRechazada(f"pesa {megabytes:.0f} MB y el máximo es {INGESTA_MAX_MB:.0f} MB.")
+    try:
+        with warnings.catch_warnings():
+            # El aviso de Pillow se sustituye por la comprobación de abajo, con un mensaje más claro
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            imagen = Image.open(io.BytesIO(datos))
+    except Image.DecompressionBombError:
+        raise ImagenRechazada("declara demasiados píxeles para abrirla con seguridad.")
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise ImagenRechazada("no es una imagen JPG, PNG o WEBP válida.")
+
+    if imagen.format not in FORMATOS:
+        raise ImagenRechazada(f"es de tipo {imagen.format or 'desconocido'}; solo se admiten JPG, PNG y WEBP.")
+    ancho, alto = imagen.size
+    megapixeles = ancho * alto / 1e6
+    limite = INGESTA_MAX_MEGAPIXELES_JPEG if imagen.format == "JPEG" else INGESTA_MAX_MEGAPIXELES
+    if megapixeles > limite:
+        raise ImagenRechazada(
+            f"mide {ancho} por {alto} píxeles ({megapixeles:.0f} megapíxeles) y el máximo "
+            f"para {FORMATOS[imagen.format]} es {limite:.0f} megapíxeles."
+        )
+    return imagen.format, ancho, alto
+
+
+@contextmanager
+def turno_decodificacion(ancho, alto):
+    """Espera turno si decodificar `ancho`×`alto` píxeles supera lo que se permite sin esperar"""
+    if ancho * alto <= INGESTA_MEGAPIXELES_LIBRES * 1e6:
+        yield
+        return
+    with _turnos:
+        yield
+
+
+def decodificar_acotado(datos, lado=None):
+    """PIL.Image RGB de los bytes subidos, con memoria acotada.
+
+    Con `lado`, el resultado mide como mucho `lado` px por lado: los JPEG ya se
+    decodifican reducidos (draft) y el resto se reduce nada más cargarse, así que
+    los píxeles completos no sobreviven a esta llamada.
+    """
+    imagen = Image.open(io.BytesIO(datos))
+    if lado and imagen.format == "JPEG":
+        imagen.draft('RGB', (lado, lado))
+    with turno_decodificacion(*imagen.size):
+        imagen.load()
+        if lado:
+            imagen.thumbnail((lado, lado))
+        if imagen.mode != 'RGB':
+            imagen = imagen.convert('RGB')
+    return imagen
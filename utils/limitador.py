@@ -0,0 +1,47 @@
+"""Módulo de limitación de tasa: token bucket para respetar la cuota de Gemini"""
+
+import threading
+import time
+
+
+class LimitadorTasa:
+    """Token bucket seguro entre hilos: `rpm` solicitudes por minuto con ráfagas de `rafaga`"""
+
+    def __init__(self, rpm=15, rafaga=None):
+        self.rpm = max(1, int(rpm))
+        self.capacidad = float(rafaga if rafaga is not None else min(self.rpm, 5))
+        self._fichas = self.capacidad
+        self._por_segundo = self.rpm / 60.0
+        self._ultimo = time.monotonic()
+        self._pausa_hasta = 0.0
+        self._lock = threading.Lock()
+
+    def _rellenar(self, ahora):
+        # Durante una pausa no se acumulan fichas
+        desde = max(self._ultimo, self._pausa_hasta)
+        self._ultimo = ahora
+        if ahora > desde:
+            self._fichas = min(self.capacidad, self._fichas + (ahora - desde) * self._por_segundo)
+
+    def adquirir(self):
+        """Bloquea hasta que haya una ficha disponible. Devuelve los segundos esperados"""
+        esperado = 0.0
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._rellenar(ahora)
+                if ahora < self._pausa_hasta:
+                    espera = self._pausa_hasta - ahora
+                elif self._fichas >= 1:
+                    self._fichas -= 1
+                    return esperado
+                else:
+                    espera = (1 - self._fichas) / self._por_segundo
+            time.sleep(espera)
+            esperado += espera
+
+    def pausar(self, segundos):
+        """Detiene a todos los hilos (p. ej. tras un 429) y vacía el cubo"""
+        with self._lock:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+            self._fichas = 0.0
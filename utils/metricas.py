@@ -0,0 +1,181 @@
+"""Módulo de métricas: tiempos por etapa, percentiles, contadores, indicadores y tokens
+
+Un único registro por proceso (`metricas`) que comparten la app, la CLI y los
+módulos de utils. Se exporta como JSON (`instantanea`) o en formato de texto de
+Prometheus (`prometheus`), y `servir_http` lo publica en /metrics.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Etapas del pipeline en su orden; el panel las lista así y después las demás (arranque, render...)
+ETAPAS = ("decodificar", "miniatura", "preprocesar", "espera_api", "parsear", "exif", "codificar", "zip")
+CUANTILES = (0.5, 0.95, 0.99)
+# Muestras por etapa para los percentiles (ventana deslizante)
+MUESTRAS_MAX = 2048
+
+
+def _percentil(ordenadas, q):
+    if not ordenadas:
+        return None
+    posicion = q * (len(ordenadas) - 1)
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenadas) - 1)
+    return ordenadas[inferior] + (ordenadas[superior] - ordenadas[inferior]) * (posicion - inferior)
+
+
+class Histograma:
+    """Total, suma y últimas `muestras_max` observaciones de una etapa"""
+
+    __slots__ = ("total", "suma", "muestras")
+
+    def __init__(self, muestras_max=MUESTRAS_MAX):
+        self.total = 0
+        self.suma = 0.0
+        self.muestras = deque(maxlen=muestras_max)
+
+    def observar(self, valor):
+        self.total += 1
+        self.suma += valor
+        self.muestras.append(valor)
+
+    def resumen(self):
+        ordenadas = sorted(self.muestras)
+        return {
+            "total": self.total,
+            "suma": round(self.suma, 6),
+            **{f"p{int(q * 100)}": _percentil(ordenadas, q) for q in CUANTILES},
+        }
+
+
+class Metricas:
+    """Registro seguro entre hilos de duraciones por etapa (s), contadores, indicadores y tokens"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._etapas = {}
+        self._contadores = {}
+        # Valores instantáneos (p. ej. profundidad de las colas del pipeline)
+        self._indicadores = {}
+        # Tokens consumidos por categoría de prompt: {categoría: {entrada, salida, texto, imagen}}
+        self._tokens = {}
+        self.inicio = time.time()
+
+    def observar(self, etapa, segundos):
+        with self._lock:
+            histograma = self._etapas.get(etapa)
+            if histograma is None:
+                histograma = self._etapas[etapa] = Histograma()
+            histograma.observar(segundos)
+
+    @contextmanager
+    def cronometro(self, etapa):
+        """with metricas.cronometro("exif"): ... registra la duración aunque haya excepción"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(etapa, time.perf_counter() - inicio)
+
+    def contar(self, nombre, n=1):
+        with self._lock:
+            self._contadores[nombre] = self._contadores.get(nombre, 0) + n
+
+    def fijar(self, nombre, valor):
+        with self._lock:
+            self._indicadores[nombre] = valor
+
+    def contar_tokens(self, categoria, uso):
+        with self._lock:
+            acumulado = self._tokens.setdefault(categoria, {})
+            for campo, valor in uso.items():
+                acumulado[campo] = acumulado.get(campo, 0) + valor
+
+    def reiniciar(self):
+        with self._lock:
+            self._etapas.clear()
+            self._contadores.clear()
+            self._indicadores.clear()
+            self._tokens.clear()
+            self.inicio = time.time()
+
+    def instantanea(self):
+        """Dict serializable: percentiles por etapa, contadores, indicadores y tokens por categoría"""
+        with self._lock:
+            etapas = {nombre: h.resumen() for nombre, h in self._etapas.items()}
+            contadores = dict(self._contadores)
+            indicadores = dict(self._indicadores)
+            tokens = {categoria: dict(uso) for categoria, uso in self._tokens.items()}
+        return {"desde": self.inicio, "etapas": etapas, "contadores": contadores,
+                "indicadores": indicadores, "tokens": tokens}
+
+    def prometheus(self, prefijo="garytext"):
+        """Texto de exposición de Prometheus (summary por etapa, counters, gauges y tokens)"""
+        datos = self.instantanea()
+        lineas = [
+            f"# HELP {prefijo}_etapa_segundos Duración de cada etapa del pipeline",
+            f"# TYPE {prefijo}_etapa_segundos summary",
+        ]
+        for etapa, resumen in sorted(datos["etapas"].items()):
+            for q in CUANTILES:
+                valor = resumen[f"p{int(q * 100)}"]
+                if valor is not None:
+                    lineas.append(f'{prefijo}_etapa_segundos{{etapa="{etapa}",quantile="{q}"}} {valor:.6f}')
+            lineas.append(f'{prefijo}_etapa_segundos_sum{{etapa="{etapa}"}} {resumen["suma"]:.6f}')
+            lineas.append(f'{prefijo}_etapa_segundos_count{{etapa="{etapa}"}} {resumen["total"]}')
+        lineas += [
+            f"# HELP {prefijo}_eventos_total Reintentos, 429, aciertos de caché y otros eventos",
+            f"# TYPE {prefijo}_eventos_total counter",
+        ]
+        for nombre, valor in sorted(datos["contadores"].items()):
+            lineas.append(f'{prefijo}_eventos_total{{evento="{nombre}"}} {valor}')
+        lineas += [
+            f"# HELP {prefijo}_indicador Valores instantáneos, como la profundidad de las colas",
+            f"# TYPE {prefijo}_indicador gauge",
+        ]
+        for nombre, valor in sorted(datos["indicadores"].items()):
+            lineas.append(f'{prefijo}_indicador{{nombre="{nombre}"}} {valor}')
+        lineas += [
+            f"# HELP {prefijo}_tokens_total Tokens de Gemini por categoría de prompt y tipo",
+            f"# TYPE {prefijo}_tokens_total counter",
+        ]
+        for categoria, uso in sorted(datos["tokens"].items()):
+            for tipo, valor in sorted(uso.items()):
+                lineas.append(f'{prefijo}_tokens_total{{categoria="{categoria}",tipo="{tipo}"}} {valor}')
+        return "\n".join(lineas) + "\n"
+
+
+metricas = Metricas()
+
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    registro = metricas
+
+    def do_GET(self):
+        if self.path.split("?")[0] in ("/metrics", "/"):
+            cuerpo, tipo = self.registro.prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path.split("?")[0] == "/metrics.json":
+            cuerpo, tipo = json.dumps(self.registro.instantanea()).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def servir_http(puerto, host="0.0.0.0", registro=metricas):
+    """Publica /metrics (Prometheus) y /metrics.json en un hilo de fondo; devuelve el servidor"""
+    manejador = type("ManejadorMetricas", (_ManejadorMetricas,), {"registro": registro})
+    servidor = ThreadingHTTPServer((host, int(puerto)), manejador)
+    threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    return servidor
@@ -0,0 +1,153 @@
+"""Módulo de pipeline: etapas encadenadas con colas acotadas que trabajan a la vez
+
+Mientras una imagen espera a Gemini, la siguiente ya se decodifica y la anterior
+se codifica. Las colas acotadas frenan a la etapa rápida cuando la lenta no da
+abasto, así que la memoria no crece con el tamaño del lote.
+"""
+
+import queue
+import threading
+import time
+
+from utils.metricas import metricas
+
+_FIN = object()
+
+
+class Etapa:
+    """`funcion(elemento) -> elemento` ejecutada por `hilos` hilos.
+
+    Con `lote` > 1 la función recibe una lista de hasta `lote` elementos (los que
+    ya estén esperando en la cola) y devuelve una lista del mismo largo.
+    """
+
+    def __init__(self, nombre, funcion, hilos=1, capacidad=4, lote=1):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.hilos = max(1, hilos)
+        self.capacidad = max(1, capacidad)
+        self.lote = max(1, lote)
+
+
+class Pipeline:
+    """Ejecuta elementos a través de `etapas`; la salida llega en orden de finalización"""
+
+    def __init__(self, etapas, nombre="pipeline"):
+        self.etapas = list(etapas)
+        self.nombre = nombre
+        self.error = None
+        self._cancelado = threading.Event()
+        self._colas = [queue.Queue(maxsize=e.capacidad) for e in self.etapas]
+        self._salida = queue.Queue()
+        self._ocupado = {e.nombre: 0.0 for e in self.etapas}
+        self._lock = threading.Lock()
+
+    def cancelar(self):
+        self._cancelado.set()
+
+    def profundidades(self):
+        """Elementos esperando a la entrada de cada etapa"""
+        return {e.nombre: c.qsize() for e, c in zip(self.etapas, self._colas)}
+
+    def resumen(self):
+        """Segundos de trabajo efectivo por etapa (repartido entre sus hilos)"""
+        with self._lock:
+            return {e.nombre: self._ocupado[e.nombre] / e.hilos for e in self.etapas}
+
+    def _poner(self, cola, elemento):
+        # Espera con timeout para poder abandonar si se cancela con la cola llena
+        while not self._cancelado.is_set():
+            try:
+                cola.put(elemento, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _alimentar(self, elementos):
+        try:
+            for elemento in elementos:
+                if not self._poner(self._colas[0], elemento):
+                    break
+        except Exception as e:
+            self.error = self.error or e
+            self._cancelado.set()
+        finally:
+            self._colas[0].put(_FIN)
+
+    def _tomar(self, cola, etapa):
+        """Hasta `etapa.lote` elementos; None si la etapa ya recibió el fin"""
+        primero = cola.get()
+        if primero is _FIN:
+            cola.put(_FIN)
+            return None
+        tomados = [primero]
+        while len(tomados) < etapa.lote:
+            try:
+                siguiente = cola.get_nowait()
+            except queue.Empty:
+                break
+            if siguiente is _FIN:
+                cola.put(_FIN)
+                break
+            tomados.append(siguiente)
+        return tomados
+
+    def _trabajar(self, indice, vivos):
+        etapa = self.etapas[indice]
+        entrada = self._colas[indice]
+        salida = self._colas[indice + 1] if indice + 1 < len(self.etapas) else self._salida
+        try:
+            while True:
+                tomados = self._tomar(entrada, etapa)
+                metricas.fijar(f"cola_{etapa.nombre}", entrada.qsize())
+                if tomados is None:
+                    return
+                if self._cancelado.is_set():
+                    continue
+                inicio = time.perf_counter()
+                try:
+                    if etapa.lote > 1:
+                        resultados = etapa.funcion(tomados)
+                    else:
+                        resultados = [etapa.funcion(tomados[0])]
+                except Exception as e:
+                    self.error = self.error or e
+                    self._cancelado.set()
+                    continue
+                finally:
+                    with self._lock:
+                        self._ocupado[etapa.nombre] += time.perf_counter() - inicio
+                for resultado in resultados:
+                    if salida is self._salida:
+                        salida.put(resultado)
+                    elif not self._poner(salida, resultado):
+                        break
+        finally:
+            # El último hilo de la etapa avisa del fin a la siguiente
+            with self._lock:
+                vivos[indice] -= 1
+                ultimo = vivos[indice] == 0
+            if ultimo:
+                salida.put(_FIN)
+
+    def ejecutar(self, elementos):
+        """Genera las salidas de la última etapa; relanza el primer error de cualquier etapa"""
+        vivos = [e.hilos for e in self.etapas]
+        hilos = [threading.Thread(target=self._alimentar, args=(elementos,),
+                                  name=f"{self.nombre}-entrada", daemon=True)]
+        for i, etapa in enumerate(self.etapas):
+            hilos += [threading.Thread(target=self._trabajar, args=(i, vivos),
+                                       name=f"{self.nombre}-{etapa.nombre}", daemon=True)
+                      for _ in range(etapa.hilos)]
+        for hilo in hilos:
+            hilo.start()
+        while True:
+            resultado = self._salida.get()
+            if resultado is _FIN:
+                break
+            yield resultado
+        for hilo in hilos:
+            hilo.join()
+        if self.error is not None:
+            raise self.error
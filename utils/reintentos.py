@@ -0,0 +1,191 @@
+"""Módulo de reintentos: clasificación de errores, backoff con jitter, plazos y disyuntor"""
+
+import random
+import re
+import threading
+import time
+
+from google.api_core import exceptions as gexc
+
+from utils.metricas import metricas
+
+CUOTA = "cuota"
+TRANSITORIO = "transitorio"
+PERMANENTE = "permanente"
+
+_CUOTA = (gexc.ResourceExhausted, gexc.TooManyRequests)
+_TRANSITORIOS = (
+    gexc.ServiceUnavailable, gexc.InternalServerError, gexc.DeadlineExceeded,
+    gexc.GatewayTimeout, gexc.BadGateway, gexc.Aborted, gexc.RetryError,
+    ConnectionError, TimeoutError,
+)
+
+_RETRASO_TEXTO = (
+    re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)', re.IGNORECASE),
+    re.compile(r'retry in\s+([\d.]+)\s*s', re.IGNORECASE),
+)
+
+
+class CircuitoAbierto(Exception):
+    """La API falla de forma continuada; no se envían solicitudes hasta `reintentar_en` s"""
+
+    def __init__(self, reintentar_en):
+        super().__init__(f"Servicio no disponible temporalmente; se reintentará en {reintentar_en:.0f}s")
+        self.reintentar_en = reintentar_en
+
+
+class PlazoAgotado(Exception):
+    """No queda tiempo para otro intento dentro del plazo de la imagen"""
+
+
+def clasificar_error(error):
+    """CUOTA (429), TRANSITORIO (5xx, red, timeouts) o PERMANENTE (petición inválida, clave, bloqueo)"""
+    if isinstance(error, _CUOTA):
+        return CUOTA
+    if isinstance(error, _TRANSITORIOS):
+        return TRANSITORIO
+    if isinstance(error, gexc.GoogleAPICallError):
+        return TRANSITORIO if (error.code or 0) >= 500 else PERMANENTE
+    # Errores sin tipo (p. ej. envueltos por la librería): último recurso, el texto
+    texto = str(error)
+    if "429" in texto or "quota" in texto.lower():
+        return CUOTA
+    if any(codigo in texto for codigo in ("500", "502", "503", "504")):
+        return TRANSITORIO
+    return PERMANENTE
+
+
+def retraso_servidor(error):
+    """Segundos de espera que pide el servidor (RetryInfo o Retry-After), o None"""
+    for detalle in getattr(error, "details", None) or ():
+        retraso = getattr(detalle, "retry_delay", None)
+        if retraso is not None:
+            return retraso.seconds + retraso.nanos / 1e9
+    respuesta = getattr(error, "response", None)
+    cabecera = getattr(respuesta, "headers", {}).get("Retry-After") if respuesta is not None else None
+    if cabecera:
+        try:
+            return float(cabecera)
+        except ValueError:
+            pass
+    for patron in _RETRASO_TEXTO:
+        coincidencia = patron.search(str(error))
+        if coincidencia:
+            return float(coincidencia.group(1))
+    return None
+
+
+class Disyuntor:
+    """Circuit breaker compartido: tras `umbral` fallos seguidos deja de llamar durante `enfriamiento` s.
+
+    Pasado el enfriamiento deja pasar una única solicitud de prueba; si sale bien
+    se cierra, y si falla vuelve a abrirse.
+    """
+
+    def __init__(self, umbral=5, enfriamiento=30.0):
+        self.umbral = max(1, int(umbral))
+        self.enfriamiento = float(enfriamiento)
+        self._fallos = 0
+        self._abierto_hasta = 0.0
+        self._probando = False
+        self._lock = threading.Lock()
+
+    @property
+    def abierto(self):
+        with self._lock:
+            return self._fallos >= self.umbral and time.monotonic() < self._abierto_hasta
+
+    def permitir(self):
+        """Lanza CircuitoAbierto si no se debe llamar a la API ahora"""
+        with self._lock:
+            if self._fallos < self.umbral:
+                return
+            ahora = time.monotonic()
+            if ahora < self._abierto_hasta:
+                raise CircuitoAbierto(self._abierto_hasta - ahora)
+            if self._probando:
+                raise CircuitoAbierto(self.enfriamiento)
+            self._probando = True
+
+    def cancelar(self):
+        """La solicitud que `permitir` dejó pasar no llegó a enviarse"""
+        with self._lock:
+            self._probando = False
+
+    def exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._probando = False
+
+    def fallo(self):
+        with self._lock:
+            self._fallos += 1
+            self._probando = False
+            if self._fallos >= self.umbral:
+                self._abierto_hasta = time.monotonic() + self.enfriamiento
+
+
+class PoliticaReintentos:
+    """Hasta `intentos` llamadas con backoff exponencial y jitter completo, dentro de `plazo` s"""
+
+    def __init__(self, intentos=4, base=1.0, maximo=30.0, plazo=90.0):
+        self.intentos = max(1, int(intentos))
+        self.base = float(base)
+        self.maximo = float(maximo)
+        self.plazo = float(plazo)
+
+    def espera(self, intento, error):
+        """Segundos antes del intento siguiente; el retraso del servidor manda si lo hay"""
+        servidor = retraso_servidor(error)
+        if servidor is not None:
+            return min(self.maximo, servidor) + random.uniform(0, self.base)
+        return random.uniform(0, min(self.maximo, self.base * 2 ** intento))
+
+    def ejecutar(self, operacion, limitador=None, disyuntor=None, intentos=None, registro=None):
+        """Llama a `operacion(restante)` reintentando los errores recuperables.
+
+        `restante` son los segundos que quedan de plazo, para usarlos como timeout de
+        la solicitud. Los errores de cuota pausan el limitador compartido, así que
+        frenan a todo el lote y no solo a este hilo.
+        """
+        intentos = intentos or self.intentos
+        limite = time.monotonic() + self.plazo
+        for intento in range(intentos):
+            if time.monotonic() >= limite:
+                raise PlazoAgotado(f"Plazo de {self.plazo:.0f}s agotado tras {intento} intentos")
+            if disyuntor is not None:
+                disyuntor.permitir()
+            if limitador is not None:
+                limitador.adquirir()
+                # La espera por la ficha también consume plazo: no enviar una solicitud sin tiempo
+                if time.monotonic() >= limite:
+                    if disyuntor is not None:
+                        disyuntor.cancelar()
+                    raise PlazoAgotado(f"Plazo de {self.plazo:.0f}s agotado esperando turno tras {intento} intentos")
+            try:
+                resultado = operacion(max(1.0, limite - time.monotonic()))
+            except Exception as e:
+                tipo = clasificar_error(e)
+                if registro:
+                    registro(intento, intentos, tipo, e)
+                if tipo == PERMANENTE:
+                    # Un error de la petición no dice nada de la salud del servicio
+                    if disyuntor is not None:
+                        disyuntor.exito()
+                    raise
+                if disyuntor is not None:
+                    disyuntor.fallo()
+                if intento == intentos - 1:
+                    raise
+                espera = self.espera(intento, e)
+                if time.monotonic() + espera >= limite:
+                    raise
+                metricas.contar("reintentos")
+                if tipo == CUOTA and limitador is not None:
+                    limitador.pausar(espera)
+                else:
+                    time.sleep(espera)
+                continue
+            if disyuntor is not None:
+                disyuntor.exito()
+            return resultado
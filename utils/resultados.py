@@ -0,0 +1,137 @@
+"""Módulo de resultados: registro compacto por imagen y presupuesto de memoria por sesión"""
+
+import io
+import os
+import tempfile
+import weakref
+
+from utils.ingesta import decodificar_acotado
+
+MINIATURA_LADO = 200
+
+
+def _borrar_archivo(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+
+def reducir_imagen(origen, lado=MINIATURA_LADO):
+    """Copia RGB de como mucho `lado` px por lado.
+
+    `origen` son los bytes subidos o una PIL.Image. Con bytes se decodifica con
+    memoria acotada: los JPEG con draft(), a 1/2, 1/4 u 1/8 de escala.
+    """
+    if isinstance(origen, (bytes, bytearray)):
+        return decodificar_acotado(origen, lado)
+    copia = origen.copy()
+    copia.thumbnail((lado, lado))
+    if copia.mode != 'RGB':
+        copia = copia.convert('RGB')
+    return copia
+
+
+def crear_miniatura(origen, lado=MINIATURA_LADO):
+    """JPEG pequeño para la lista de resultados, a partir de bytes o de una PIL.Image"""
+    copia = reducir_imagen(origen, lado)
+    buffer = io.BytesIO()
+    copia.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+class _Volcado:
+    """Archivo temporal con unos bytes originales; se borra cuando ningún Resultado lo usa"""
+
+    __slots__ = ("ruta", "__weakref__")
+
+    def __init__(self, datos, directorio):
+        os.makedirs(directorio, exist_ok=True)
+        fd, self.ruta = tempfile.mkstemp(prefix="garytext_", dir=directorio)
+        with os.fdopen(fd, "wb") as f:
+            f.write(datos)
+        weakref.finalize(self, _borrar_archivo, self.ruta)
+
+
+class Resultado:
+    """Resultado de una imagen: bytes originales comprimidos + miniatura, sin píxeles decodificados"""
+
+    __slots__ = ("id", "nombre", "descripcion", "formato", "miniatura", "posicion", "variante", "tokens",
+                 "_original", "_volcado")
+
+    def __init__(self, id, nombre, descripcion, original, formato="JPEG", miniatura=b"", posicion=0,
+                 variante=None, tokens=None):
+        self.id = id
+        self.posicion = posicion
+        # (idioma, categoría) cuando una misma imagen tiene varias descripciones
+        self.variante = variante
+        # Tokens de Gemini atribuidos a esta descripción (vacío si vino de la caché)
+        self.tokens = tokens or {}
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.formato = formato
+        self.miniatura = miniatura
+        # Las variantes de una imagen comparten estos bytes (y el archivo si se vuelcan)
+        self._original = original
+        self._volcado = None
+
+    @property
+    def original(self):
+        """Bytes tal como se subieron (se leen del disco si se volcaron)"""
+        if self._original is not None:
+            return self._original
+        with open(self._volcado.ruta, "rb") as f:
+            return f.read()
+
+    @property
+    def en_memoria(self):
+        return len(self._original) if self._original is not None else 0
+
+    def volcar_a_disco(self, directorio, volcado=None):
+        """Mueve los bytes originales a un archivo temporal (o a `volcado`, si ya existe) y los libera.
+
+        Devuelve el volcado para que las demás variantes de la imagen lo compartan.
+        """
+        if self._original is None:
+            return self._volcado
+        self._volcado = volcado or _Volcado(self._original, directorio)
+        self._original = None
+        return self._volcado
+
+    def liberar(self):
+        # El archivo se borra cuando ningún resultado conserva su volcado
+        self._original = None
+        self._volcado = None
+
+
+def _bytes_en_memoria(resultados, descargas):
+    """Bytes retenidos, contando una vez cada objeto compartido entre variantes y descargas"""
+    objetos = {id(r._original): len(r._original) for r in resultados if r._original is not None}
+    objetos.update((id(datos), len(datos)) for datos in descargas.values())
+    return sum(objetos.values())
+
+
+def aplicar_presupuesto(resultados, presupuesto, directorio, descargas=None):
+    """Vuelca a disco los originales más antiguos hasta que la sesión quepa en `presupuesto` bytes.
+
+    `descargas` es la caché {(id de imagen, descripción, metadatos): bytes} de la
+    sesión: cuenta en el presupuesto y se vacía para cada imagen volcada, porque
+    sin metadatos su descarga es el mismo objeto que el original.
+    """
+    descargas = descargas if descargas is not None else {}
+    total = _bytes_en_memoria(resultados, descargas)
+    volcados = {}
+    for r in resultados:
+        if total <= presupuesto:
+            break
+        if not r.en_memoria:
+            continue
+        clave = id(r._original)
+        volcados[clave] = r.volcar_a_disco(directorio, volcados.get(clave))
+        # Las demás variantes de la imagen comparten el original: se vuelcan al mismo archivo
+        for otro in resultados:
+            if otro._original is not None and id(otro._original) == clave:
+                otro.volcar_a_disco(directorio, volcados[clave])
+        for clave_descarga in [c for c in descargas if c[0] == r.id]:
+            del descargas[clave_descarga]
+        total = _bytes_en_memoria(resultados, descargas)
@@ -0,0 +1,74 @@
+"""Módulo de similitud: hash perceptual (dHash) con firma de color e índice por distancia de Hamming
+
+El dHash se calcula en gris, así que la misma prenda en rojo y en azul da el mismo
+hash; la firma de color (medias RGB de una rejilla) evita reutilizar entre ellas.
+"""
+
+from PIL import Image
+
+# Diferencia máxima (0-255) de la media de un canal en una celda para seguir siendo casi-duplicados
+COLOR_TOLERANCIA = 20
+
+
+def dhash(imagen, tamano=8):
+    """Hash perceptual de diferencias: `tamano`² bits sobre una copia gris reducida"""
+    pequena = imagen.resize(
+        (tamano + 1, tamano), Image.Resampling.BILINEAR, reducing_gap=2.0
+    ).convert('L')
+    pixeles = list(pequena.getdata())
+    valor = 0
+    for fila in range(tamano):
+        inicio = fila * (tamano + 1)
+        for col in range(tamano):
+            valor = (valor << 1) | (pixeles[inicio + col] > pixeles[inicio + col + 1])
+    return valor
+
+
+def firma_color(imagen, celdas=4):
+    """Medias RGB de una rejilla `celdas`×`celdas`, como tupla de enteros"""
+    if imagen.mode != 'RGB':
+        imagen = imagen.convert('RGB')
+    pequena = imagen.resize((celdas, celdas), Image.Resampling.BOX, reducing_gap=2.0)
+    return tuple(canal for pixel in pequena.getdata() for canal in pixel)
+
+
+def firma(imagen):
+    """(dHash, firma de color): lo que guarda y compara IndiceSimilitud"""
+    return dhash(imagen), firma_color(imagen)
+
+
+def distancia_color(a, b):
+    """Mayor diferencia entre las medias de un mismo canal y celda"""
+    return max((abs(x - y) for x, y in zip(a, b)), default=0)
+
+
+def distancia_hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class IndiceSimilitud:
+    """Índice de firmas: casi-duplicados dentro de un umbral de bits y con los mismos colores"""
+
+    def __init__(self, umbral=5, tolerancia_color=COLOR_TOLERANCIA):
+        self.umbral = umbral
+        self.tolerancia_color = tolerancia_color
+        self._entradas = []
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def buscar(self, firma_imagen):
+        """Devuelve el valor de la firma más cercana dentro del umbral y la tolerancia de color, o None"""
+        hash_perceptual, color = firma_imagen
+        mejor = None
+        mejor_distancia = self.umbral + 1
+        for (h, c), valor in self._entradas:
+            distancia = distancia_hamming(h, hash_perceptual)
+            if distancia < mejor_distancia and distancia_color(c, color) <= self.tolerancia_color:
+                mejor, mejor_distancia = valor, distancia
+                if distancia == 0:
+                    break
+        return mejor
+
+    def agregar(self, firma_imagen, valor):
+        self._entradas.append((firma_imagen, valor))
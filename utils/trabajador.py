@@ -0,0 +1,274 @@
+"""Módulo de trabajo en segundo plano: procesa el lote de una sesión fuera del script de Streamlit"""
+
+import io
+import logging
+import threading
+import time
+
+from PIL import Image
+
+from utils.gemini import (
+    ENVIO_CALIDAD, ENVIO_LADO_MAX, GEMINI_HILOS, GEMINI_POR_SOLICITUD, costo_tokens, describir_grupo,
+    obtener_backend, obtener_limitador, sumar_tokens
+)
+from utils.imagen import con_descripcion, es_jpeg, preparar_para_envio
+from utils.ingesta import decodificar_acotado
+from utils.metricas import metricas
+from utils.pipeline import Etapa, Pipeline
+from utils.resultados import crear_miniatura
+from utils.similitud import IndiceSimilitud, firma
+
+log = logging.getLogger("garytext")
+
+# Si nadie recoge resultados durante este tiempo, la sesión se da por abandonada
+ABANDONO_SEGUNDOS = 120
+
+
+class ImagenTerminada:
+    """Lo que la sesión necesita para crear los Resultado de una imagen ya descrita"""
+
+    __slots__ = ("posicion", "original", "respuestas", "miniatura", "formato", "descargas")
+
+    def __init__(self, posicion, original, respuestas, miniatura, formato, descargas=None):
+        self.posicion = posicion
+        self.original = original
+        self.respuestas = respuestas
+        self.miniatura = miniatura
+        self.formato = formato
+        # {descripción: bytes de descarga} ya preparados con la opción de metadatos del lote
+        self.descargas = descargas or {}
+
+
+class _Elemento:
+    """Imagen en tránsito por el pipeline"""
+
+    __slots__ = ("posicion", "miniatura", "formato", "firma", "envio", "respuestas", "lider", "reutilizada")
+
+    def __init__(self, posicion):
+        self.posicion = posicion
+        self.miniatura = None
+        self.formato = None
+        # (dHash, firma de color) para buscar casi-duplicados
+        self.firma = None
+        # Bytes ya reducidos para Gemini; None si no hay que enviarla
+        self.envio = None
+        self.respuestas = None
+        # Posición de la imagen casi idéntica del lote cuya respuesta se reutiliza
+        self.lider = None
+        # Respuesta tomada de un casi-duplicado (de este lote o de uno anterior)
+        self.reutilizada = False
+
+
+class TrabajadorLote:
+    """Hilo de fondo que describe las imágenes pendientes de un lote.
+
+    Cada imagen recorre tres etapas que trabajan a la vez: decodificar (y
+    reducir para el envío), gemini y codificar (descargas). Mientras
+    una imagen espera a la API, la siguiente ya se decodifica y la anterior se
+    codifica; las colas acotadas limitan cuántas hay en memoria.
+
+    No toca st.session_state: cada imagen terminada se registra en el diario y
+    se deja en una cola que la sesión vacía con recoger(). Si la sesión deja de
+    recoger durante `abandono` s (pestaña cerrada), no entran más imágenes y se
+    terminan las que ya estaban dentro; lo registrado en el diario se recupera
+    al volver.
+    """
+
+    def __init__(self, trabajo, originales, indice_similitud, diario, tam_bloque,
+                 umbral_similitud, inicio=0, abandono=ABANDONO_SEGUNDOS, guardar_exif=False):
+        self.trabajo = trabajo
+        # {posición: bytes subidos}, en el orden en que se procesan
+        self.originales = originales
+        self.indice_similitud = indice_similitud
+        self.diario = diario
+        # Imágenes que caben a la vez en cada cola del pipeline
+        self.tam_bloque = max(1, tam_bloque)
+        self.umbral_similitud = umbral_similitud
+        self.abandono = abandono
+        self.guardar_exif = guardar_exif
+        # Imágenes del lote ya terminadas antes de arrancar (recuperadas del diario)
+        self.inicio = inicio
+        self.total = len(originales)
+        self.hechas = 0
+        self.error = None
+        self.variantes = [tuple(v) for v in trabajo["variantes"]]
+        self._terminadas = []
+        self._lock = threading.Lock()
+        self._cancelado = threading.Event()
+        self._ultimo_contacto = time.monotonic()
+        # Casi-duplicados dentro de este lote: firma → posición del líder
+        self._en_vuelo = IndiceSimilitud(umbral_similitud)
+        # Respuestas de los líderes ya terminados y seguidores a la espera de su líder
+        self._resueltas = {}
+        self._esperando = {}
+        self._reutilizadas = 0
+        # Token bucket compartido por todas las sesiones; se resuelve al arrancar el hilo
+        self.limitador = None
+        # Tokens gastados por este lote, por categoría de prompt
+        self.tokens = {}
+        self.pipeline = Pipeline(self._etapas(), nombre="lote")
+        self._hilo = threading.Thread(target=self._ejecutar, name="lote", daemon=True)
+
+    def _etapas(self):
+        # El empaquetado solo se usa con una variante; con varias, cada llamada es una imagen
+        lote = GEMINI_POR_SOLICITUD if len(self.variantes) == 1 else 1
+        return [
+            Etapa("decodificar", self._decodificar, capacidad=self.tam_bloque),
+            Etapa("gemini", self._describir, hilos=GEMINI_HILOS, capacidad=self.tam_bloque, lote=lote),
+            Etapa("codificar", self._codificar, capacidad=self.tam_bloque),
+        ]
+
+    def iniciar(self):
+        self._hilo.start()
+        return self
+
+    @property
+    def terminado(self):
+        return not self._hilo.is_alive()
+
+    def cancelar(self):
+        """Deja de meter imágenes y descarta lo que no haya empezado"""
+        self._cancelado.set()
+        self.pipeline.cancelar()
+
+    def recoger(self):
+        """Imágenes terminadas desde la última llamada (y señal de que la sesión sigue viva)"""
+        with self._lock:
+            self._ultimo_contacto = time.monotonic()
+            nuevas, self._terminadas = self._terminadas, []
+        return nuevas
+
+    def profundidades(self):
+        """Imágenes esperando a la entrada de cada etapa"""
+        return self.pipeline.profundidades()
+
+    def _abandonado(self):
+        with self._lock:
+            return time.monotonic() - self._ultimo_contacto > self.abandono
+
+    def _posiciones(self):
+        for posicion in self.originales:
+            if self._cancelado.is_set():
+                return
+            if self._abandonado():
+                log.info("Sesión sin actividad: se detiene el lote en segundo plano")
+                return
+            yield posicion
+
+    def _ejecutar(self):
+        inicio = time.perf_counter()
+        try:
+            # Resolver el backend y el limitador cacheados antes de lanzar los hilos del pipeline
+            obtener_backend()
+            self.limitador = obtener_limitador()
+            for _ in self.pipeline.ejecutar(self._posiciones()):
+                pass
+        except Exception as e:
+            log.error(f"Error en el lote en segundo plano: {str(e)}")
+            self.error = str(e)
+        ocupado = self.pipeline.resumen()
+        if ocupado:
+            detalle = ", ".join(f"{nombre} {s:.1f} s" for nombre, s in ocupado.items())
+            log.info(f"Lote de {self.hechas} imágenes en {time.perf_counter() - inicio:.1f} s "
+                     f"(suma de etapas {sum(ocupado.values()):.1f} s, máxima {max(ocupado.values()):.1f} s: {detalle})")
+        if self._reutilizadas:
+            log.info(f"Casi-duplicados reutilizados: {self._reutilizadas} de {self.total}")
+        if self.tokens:
+            total = sumar_tokens(*self.tokens.values())
+            detalle = ", ".join(f"{categoria} {uso.get('entrada', 0)}/{uso.get('salida', 0)}"
+                                for categoria, uso in sorted(self.tokens.items()))
+            log.info(f"Tokens del lote: {total.get('entrada', 0)} de entrada, {total.get('salida', 0)} de salida, "
+                     f"~{costo_tokens(total):.4f} USD (entrada/salida por categoría: {detalle})")
+
+    def _decodificar(self, posicion):
+        elemento = _Elemento(posicion)
+        original = self.originales[posicion]
+        fuente = Image.open(io.BytesIO(original))
+        elemento.formato = fuente.format
+        # Copia de trabajo del tamaño del envío (JPEG con draft()): los píxeles completos no salen de aquí
+        with metricas.cronometro("decodificar"):
+            trabajo = decodificar_acotado(original, ENVIO_LADO_MAX)
+        with metricas.cronometro("miniatura"):
+            elemento.miniatura = crear_miniatura(trabajo)
+        elemento.firma = firma(trabajo)
+
+        with self._lock:
+            reutilizado = self.indice_similitud.buscar(elemento.firma)
+            lider = None if reutilizado is not None else self._en_vuelo.buscar(elemento.firma)
+            if reutilizado is None and lider is None:
+                self._en_vuelo.agregar(elemento.firma, posicion)
+        if reutilizado is not None:
+            elemento.respuestas = reutilizado
+            elemento.reutilizada = True
+        elif lider is not None:
+            elemento.lider = lider
+            elemento.reutilizada = True
+        else:
+            # Se prepara aquí para que la etapa gemini solo espere; un JPEG que ya cabe va tal cual
+            cabe = es_jpeg(original) and max(fuente.size) <= ENVIO_LADO_MAX
+            with metricas.cronometro("preprocesar"):
+                elemento.envio = preparar_para_envio(original if cabe else trabajo, ENVIO_LADO_MAX, ENVIO_CALIDAD)
+        return elemento
+
+    def _describir(self, entrada):
+        # Con empaquetado la etapa recibe y devuelve listas; si no, un elemento suelto
+        elementos = entrada if isinstance(entrada, list) else [entrada]
+        pendientes = [e for e in elementos if e.envio is not None]
+        if pendientes:
+            respuestas = describir_grupo(
+                [e.envio for e in pendientes], self.variantes, limitador=self.limitador,
+                huellas=[self.trabajo["huellas"][e.posicion] for e in pendientes]
+            )
+            for elemento, lista in zip(pendientes, respuestas):
+                elemento.respuestas = lista
+                elemento.envio = None
+            enviados = sum(r.get('bytes_enviados', 0) for lista in respuestas for r in lista)
+            subidos = sum(len(self.originales[e.posicion]) for e in pendientes)
+            log.info(f"Bytes enviados: {enviados / 1024:.0f} KB de {subidos / 1024:.0f} KB originales")
+        return entrada
+
+    def _codificar(self, elemento):
+        if elemento.lider is not None:
+            with self._lock:
+                respuestas = self._resueltas.get(elemento.lider)
+                if respuestas is None:
+                    # El líder aún no ha salido de gemini: se publica cuando lo haga
+                    self._esperando.setdefault(elemento.lider, []).append(elemento)
+                    return elemento
+            elemento.respuestas = respuestas
+        self._publicar(elemento)
+
+        with self._lock:
+            self._resueltas[elemento.posicion] = elemento.respuestas
+            seguidores = self._esperando.pop(elemento.posicion, [])
+        for seguidor in seguidores:
+            seguidor.respuestas = elemento.respuestas
+            self._publicar(seguidor)
+        return elemento
+
+    def _publicar(self, elemento):
+        posicion, respuestas = elemento.posicion, elemento.respuestas
+        if elemento.reutilizada:
+            # La llamada la pagó el original: la copia no envía bytes ni gasta tokens
+            respuestas = [{**r, "bytes_enviados": 0, "tokens": {}} for r in respuestas]
+        original = self.originales[posicion]
+        correcto = all(r['nombre'] != "error" for r in respuestas)
+        self.diario.registrar(self.trabajo["id"], self.trabajo["huellas"][posicion], respuestas, correcto)
+        if correcto and not elemento.reutilizada:
+            with self._lock:
+                self.indice_similitud.agregar(elemento.firma, respuestas)
+
+        descargas = {}
+        for r in respuestas:
+            if r['nombre'] == "error" or r['descripcion'] in descargas:
+                continue
+            descargas[r['descripcion']] = con_descripcion(original, r['descripcion'] if self.guardar_exif else None)
+
+        terminada = ImagenTerminada(posicion, original, respuestas, elemento.miniatura,
+                                    elemento.formato, descargas)
+        with self._lock:
+            self._terminadas.append(terminada)
+            self.hechas += 1
+            self._reutilizadas += elemento.reutilizada
+            for (_, categoria), r in zip(self.variantes, respuestas):
+                self.tokens[categoria] = sumar_tokens(self.tokens.get(categoria), r.get("tokens"))